@@ -0,0 +1,146 @@
+"""Compare encoding positions point by point and from the board's arrays.
+
+    python benchmark_encoders.py --num-games 5 --num-moves 200 --encoders oneplane,sevenplane,simple
+
+Each encoder is checked against the point-by-point encoding first, and the
+throughput of the encoders is compared with the first one. Then the games
+are replayed and encoded move by move, once with GameState.apply_move() and
+once with an IncrementalEncoding.
+"""
+from __future__ import print_function
+import argparse
+import time
+
+import numpy as np
+
+from dlgo.agent.naive_fast import FastRandomBot
+from dlgo.encoders.base import get_encoder_by_name
+from dlgo.encoders.incremental import IncrementalEncoding
+from dlgo.goboard_fast import GameState
+from dlgo.gotypes import Point
+
+
+def oneplane_by_points(encoder, game_state):
+    """OnePlaneEncoder.encode as it was before boards kept an array of stone colours."""
+    board_matrix = np.zeros(encoder.shape())
+    next_player = game_state.next_player
+    for r in range(encoder.board_height):
+        for c in range(encoder.board_width):
+            p = Point(row=r + 1, col=c + 1)
+            go_string = game_state.board.get_go_string(p)
+            if go_string is None:
+                continue
+            if go_string.color == next_player:
+                board_matrix[0, r, c] = 1
+            else:
+                board_matrix[0, r, c] = -1
+    return board_matrix
+
+
+def play_games(num_games, num_moves, board_size=19, seed=1):
+    """Play random games, returning all positions and the moves of each game."""
+    np.random.seed(seed)
+    bot = FastRandomBot()
+    positions = []
+    games = []
+    for _ in range(num_games):
+        game_state = GameState.new_game(board_size)
+        moves = []
+        for _ in range(num_moves):
+            if game_state.is_over():
+                break
+            positions.append(game_state)
+            moves.append(bot.select_move(game_state))
+            game_state = game_state.apply_move(moves[-1])
+        games.append(moves)
+    return positions, games
+
+
+def replay(encoder, moves, incremental, board_size=19):
+    """Replay a game and encode the position before every move, as the data processors do."""
+    features = np.zeros((len(moves),) + encoder.shape(), dtype=encoder.dtype())
+    game_state = GameState.new_game(board_size)
+    if incremental:
+        encoding = IncrementalEncoding(encoder, game_state.board, game_state.next_player)
+        for i, move in enumerate(moves):
+            encoding.encode_into(features[i])
+            encoding.apply_move(move)
+    else:
+        for i, move in enumerate(moves):
+            encoder.encode_into(game_state, features[i])
+            game_state = game_state.apply_move(move)
+    return features
+
+
+def compare_replay(name, games, repeat):
+    encoder = get_encoder_by_name(name, 19)
+    for moves in games:
+        if not np.array_equal(replay(encoder, moves, True), replay(encoder, moves, False)):
+            raise ValueError('%s: incremental encoding differs' % name)
+    num_positions = sum(len(moves) for moves in games)
+    full = benchmark(lambda moves: replay(encoder, moves, False), games, repeat)
+    incremental = benchmark(lambda moves: replay(encoder, moves, True), games, repeat)
+    print('%s replay, both encodings agree' % name)
+    print('  apply_move + encode_into: %.3fs (%.1f us/position)' % (full, 1e6 * full / num_positions))
+    print('  IncrementalEncoding:      %.3fs (%.1f us/position)' % (
+        incremental, 1e6 * incremental / num_positions))
+    print('  speedup: %.1fx' % (full / incremental))
+
+
+def benchmark(encode, positions, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for game_state in positions:
+            encode(game_state)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def compare(name, positions, repeat):
+    encoder = get_encoder_by_name(name, 19)
+    out = np.zeros(encoder.shape(), dtype=encoder.dtype())
+    if name == 'oneplane':
+        by_points = lambda game_state: oneplane_by_points(encoder, game_state)
+    else:
+        by_points = lambda game_state: encoder.encode_by_points(game_state, np.zeros(encoder.shape()))
+    for game_state in positions:
+        if not np.array_equal(encoder.encode(game_state, out=out), by_points(game_state)):
+            raise ValueError('%s: encodings differ' % name)
+    if not np.array_equal(encoder.encode_batch(positions),
+                          [encoder.encode(game_state) for game_state in positions]):
+        raise ValueError('%s: batch encoding differs' % name)
+
+    slow = benchmark(by_points, positions, repeat)
+    fast = benchmark(lambda game_state: encoder.encode(game_state, out=out), positions, repeat)
+    batch = benchmark(lambda states: encoder.encode_batch(states), [positions], repeat)
+    print('%s, all encodings agree' % name)
+    print('  by points:       %.3fs (%.1f us/position)' % (slow, 1e6 * slow / len(positions)))
+    print('  from the arrays: %.3fs (%.1f us/position)' % (fast, 1e6 * fast / len(positions)))
+    print('  encode_batch:    %.3fs (%.1f us/position)' % (batch, 1e6 * batch / len(positions)))
+    print('  speedup: %.1fx, %.1fx batched' % (slow / fast, slow / batch))
+    return fast
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-games', '-g', type=int, default=5)
+    parser.add_argument('--num-moves', '-m', type=int, default=200)
+    parser.add_argument('--repeat', '-r', type=int, default=3)
+    parser.add_argument('--encoders', '-e', default='oneplane,sevenplane,simple',
+                        help='Comma-separated encoder names; the first is the baseline.')
+    args = parser.parse_args()
+
+    positions, games = play_games(args.num_games, args.num_moves)
+    print('%d positions' % len(positions))
+    names = args.encoders.split(',')
+    times = [compare(name, positions, args.repeat) for name in names]
+    for name, elapsed in zip(names[1:], times[1:]):
+        print('%s takes %.1fx the time of %s' % (name, elapsed / times[0], names[0]))
+    for name in names:
+        compare_replay(name, games, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
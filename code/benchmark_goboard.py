@@ -0,0 +1,69 @@
+"""Time GameState.apply_move on boards with and without the arrays kept for encoders.
+
+    python benchmark_goboard.py --num-games 20 --num-moves 250
+
+Random games are played once, then replayed with apply_move: first on
+plain boards, as in MCTS and self-play, then on boards that were asked for
+stone_colors(), and liberty_counts() as well, and so keep them up to date
+from the first move on.
+"""
+from __future__ import print_function
+import argparse
+import time
+
+import numpy as np
+
+from dlgo.agent.naive_fast import FastRandomBot
+from dlgo.goboard_fast import GameState
+
+
+def play_games(num_games, num_moves, board_size=19, seed=1):
+    np.random.seed(seed)
+    bot = FastRandomBot()
+    games = []
+    for _ in range(num_games):
+        game_state = GameState.new_game(board_size)
+        moves = []
+        for _ in range(num_moves):
+            if game_state.is_over():
+                break
+            moves.append(bot.select_move(game_state))
+            game_state = game_state.apply_move(moves[-1])
+        games.append(moves)
+    return games
+
+
+def replay(games, prepare, repeat, board_size=19):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for moves in games:
+            game_state = GameState.new_game(board_size)
+            prepare(game_state.board)
+            for move in moves:
+                game_state = game_state.apply_move(move)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-games', '-g', type=int, default=20)
+    parser.add_argument('--num-moves', '-m', type=int, default=250)
+    parser.add_argument('--repeat', '-r', type=int, default=5)
+    args = parser.parse_args()
+
+    games = play_games(args.num_games, args.num_moves)
+    num_moves = sum(len(moves) for moves in games)
+    print('%d moves' % num_moves)
+    plain = replay(games, lambda board: None, args.repeat)
+    print('plain boards:       %.3fs (%.2f us/move)' % (plain, 1e6 * plain / num_moves))
+    tracked = replay(games, lambda board: board.stone_colors(), args.repeat)
+    print('with stone_colors:  %.3fs (%.2f us/move)' % (tracked, 1e6 * tracked / num_moves))
+    both = replay(games, lambda board: (board.stone_colors(), board.liberty_counts()), args.repeat)
+    print('and liberty_counts: %.3fs (%.2f us/move)' % (both, 1e6 * both / num_moves))
+
+
+if __name__ == '__main__':
+    main()
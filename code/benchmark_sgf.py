@@ -0,0 +1,112 @@
+"""Compare reading moves with the full SGF parser and with read_main_line.
+
+    python benchmark_sgf.py data/KGS-2008-19-14002-.tar.gz --num-games 2000
+
+Both readers are first checked to agree on a few malformed move nodes, as
+found in real KGS files, and on the games of the archive.
+"""
+from __future__ import print_function
+import argparse
+import tarfile
+import time
+
+from dlgo.gosgf import Sgf_game, read_main_line
+
+
+def moves_from_game_tree(sgf_content):
+    sgf = Sgf_game.from_string(sgf_content)
+    sgf.get_handicap()
+    sgf.get_root().get_setup_stones()
+    moves = []
+    for item in sgf.main_sequence_iter():
+        color, move_tuple = item.get_move()
+        if color is not None:
+            moves.append((color, move_tuple))
+    return moves
+
+
+def moves_from_main_line(sgf_content):
+    game = read_main_line(sgf_content)
+    game.get_handicap()
+    game.get_setup_stones()
+    return game.get_moves()
+
+
+# Move nodes with extra values, odd values or more properties. Both readers
+# must give the same moves, or both raise ValueError.
+EDGE_CASES = [
+    b"(;SZ[19];B[pd][qq];W[dd])",
+    b"(;B[pd][qq];W[dd][];B[])",
+    b"(;SZ[9];B[aa] [bb]\n;W[cc][x\\]y];B[tt])",
+    b"(;;B[pd][qq]C[hi];W[dd])",
+    b"(;;B[pd]W[qq][rr];W[dd])",
+    b"(;;W[pd][qq]B[dd])",
+    b"(;;B[];W[][aa])",
+    b"(;;B[pd][qq](;W[dd])(;W[ee]))",
+    b"(;;B[PD];W[dd])",
+    b"(;;B[pdx];W[dd])",
+    b"(;;B[ pd];W[dd])",
+]
+
+
+def check_edge_cases():
+    for sgf_content in EDGE_CASES:
+        results = []
+        for read_moves in (moves_from_game_tree, moves_from_main_line):
+            try:
+                results.append(read_moves(sgf_content))
+            except ValueError:
+                results.append(ValueError)
+        if results[0] != results[1]:
+            raise ValueError('readers differ on %r: %r' % (sgf_content, results))
+    print('%d edge cases, both readers agree' % len(EDGE_CASES))
+
+
+def read_games(archive, num_games):
+    games = []
+    with tarfile.open(archive, 'r:gz') as tar:
+        for member in tar:
+            if member.isfile() and member.name.endswith('.sgf'):
+                games.append(tar.extractfile(member).read())
+                if len(games) == num_games:
+                    break
+    return games
+
+
+def benchmark(read_moves, games, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for sgf_content in games:
+            read_moves(sgf_content)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('archive', help='a KGS .tar.gz archive')
+    parser.add_argument('--num-games', '-n', type=int, default=1000)
+    parser.add_argument('--repeat', '-r', type=int, default=3)
+    args = parser.parse_args()
+
+    check_edge_cases()
+    games = read_games(args.archive, args.num_games)
+    num_moves = 0
+    for sgf_content in games:
+        moves = moves_from_main_line(sgf_content)
+        if moves != moves_from_game_tree(sgf_content):
+            raise ValueError('main line differs from the game tree')
+        num_moves += len(moves)
+    print('%d games, %d moves, both readers agree' % (len(games), num_moves))
+
+    full = benchmark(moves_from_game_tree, games, args.repeat)
+    fast = benchmark(moves_from_main_line, games, args.repeat)
+    print('Sgf_game.from_string: %.3fs (%.1f us/move)' % (full, 1e6 * full / max(1, num_moves)))
+    print('read_main_line:       %.3fs (%.1f us/move)' % (fast, 1e6 * fast / max(1, num_moves)))
+    print('speedup: %.1fx' % (full / fast))
+
+
+if __name__ == '__main__':
+    main()
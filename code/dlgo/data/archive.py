@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import os
+import tarfile
+import zlib
+
+from dlgo.data.manifest import load_json, save_json
+
+__all__ = [
+    'ArchiveIndex',
+    'iter_all_archive_games',
+    'iter_archive_games',
+]
+
+
+class ArchiveIndex:
+    """Random access to the members of a compressed KGS archive.
+
+    A .tar.gz can only be read front to back. The first time an archive is
+    used, it is decompressed once in streaming mode and every member is
+    recompressed on its own into a pack file next to the archive:
+
+        <archive>.pack        -- zlib-compressed member contents, back to back
+        <archive>.index.json  -- member names, and offset and size in the pack
+
+    After that any member can be read with a single seek, so sampling a few
+    games of an archive doesn't require decompressing the whole of it. The
+    index records the size and modification time of the archive it was
+    built from and is rebuilt if they no longer match. It is written last,
+    atomically, so an interrupted build is simply redone.
+    """
+    def __init__(self, archive_path):
+        self.archive_path = archive_path
+        self.pack_path = archive_path + '.pack'
+        self.index_path = archive_path + '.index.json'
+        self.names = []
+        self.offsets = []
+        self.sizes = []
+        self._pack = None
+        self.load_or_build()
+
+    def _archive_stamp(self):
+        stat = os.stat(self.archive_path)
+        return [stat.st_size, int(stat.st_mtime)]
+
+    def load_or_build(self):
+        if os.path.isfile(self.index_path) and os.path.isfile(self.pack_path):
+            index = load_json(self.index_path)
+            if index['archive'] == self._archive_stamp():
+                self.names = index['names']
+                self.offsets = index['offsets']
+                self.sizes = index['sizes']
+                return
+        self.build()
+
+    def build(self):
+        """Scan the archive once and write the pack and index files."""
+        names, offsets, sizes = [], [], []
+        tmp_pack_path = '%s.%d.tmp' % (self.pack_path, os.getpid())
+        with tarfile.open(self.archive_path, 'r|gz') as tar, open(tmp_pack_path, 'wb') as pack:
+            for member in tar:
+                names.append(member.name)
+                if member.isfile():
+                    data = zlib.compress(tar.extractfile(member).read())
+                    offsets.append(pack.tell())
+                    sizes.append(len(data))
+                    pack.write(data)
+                else:
+                    offsets.append(-1)
+                    sizes.append(0)
+        os.replace(tmp_pack_path, self.pack_path)
+        save_json(self.index_path, {
+            'archive': self._archive_stamp(),
+            'names': names,
+            'offsets': offsets,
+            'sizes': sizes,
+        })
+        self.names, self.offsets, self.sizes = names, offsets, sizes
+
+    def read(self, member_index):
+        """Return the content of a member, or None if it isn't a regular file."""
+        if self.offsets[member_index] < 0:
+            return None
+        if self._pack is None:
+            self._pack = open(self.pack_path, 'rb')
+        self._pack.seek(self.offsets[member_index])
+        return zlib.decompress(self._pack.read(self.sizes[member_index]))
+
+    def close(self):
+        if self._pack is not None:
+            self._pack.close()
+            self._pack = None
+
+    def iter_games(self, game_list):
+        """Yield (index, member name, SGF content) for the given game indices.
+
+        Game index i refers to archive member i + 1, the first member being
+        the directory all games live in. Games are read in pack order.
+        """
+        for index in sorted(set(game_list)):
+            member_index = index + 1
+            if not 0 < member_index < len(self.names):
+                raise ValueError('%s has no game with index %d' % (self.archive_path, index))
+            yield index, self.names[member_index], self.read(member_index)
+
+
+def iter_archive_games(archive_path, game_list):
+    """Read selected SGF files from a compressed KGS archive.
+
+    Parameters:
+    -----------
+    archive_path: path to a .tar.gz archive of SGF files
+    game_list: indices of the games to read
+
+    Uses the archive's ArchiveIndex, building it on first use, so only the
+    selected games are decompressed. Yields tuples (index, member name, SGF
+    content) in member order.
+    """
+    index = ArchiveIndex(archive_path)
+    try:
+        for game in index.iter_games(game_list):
+            yield game
+    finally:
+        index.close()
+
+
+def iter_all_archive_games(archive_path):
+    """Read every file of a compressed KGS archive in a single pass.
+
+    For callers that need all games in order, such as building a corpus or
+    a catalog. The archive is decompressed in streaming mode and scanned
+    once; unlike ArchiveIndex, no pack or index file is written. Yields
+    tuples (index, member name, SGF content) in member order, with the same
+    game indices as iter_archive_games().
+    """
+    with tarfile.open(archive_path, 'r|gz') as tar:
+        for member_index, member in enumerate(tar):
+            if member_index == 0 or not member.isfile():
+                continue
+            yield member_index - 1, member.name, tar.extractfile(member).read()
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import glob
+import hashlib
+import json
+import os
+
+from dlgo.data.manifest import load_json, save_json
+
+__all__ = [
+    'ProcessingCache',
+]
+
+
+class ProcessingCache:
+    """Keep track of which games of which archive have already been encoded.
+
+    Processed games are stored in shards. A shard holds the chunks produced
+    for one set of games of one archive and is keyed by a hash of (archive,
+    game indices, encoder name, encoder version), so a different encoder or
+    a new encoder version never picks up stale data. A shard only counts as
+    complete once its record <key>.json has been written; that happens
+    atomically after all of its chunks are on disk, so interrupted runs
+    leave no half-finished shard behind.
+
+    The record maps every game index to the [start, stop) rows it produced
+    within the shard. Requests for an overlapping set of games therefore
+    only need to encode the games no completed shard covers yet, and can
+    take the rows of all others from existing shards.
+
+    Games that can't be parsed or replayed are listed in the record with
+    the reason under 'failed' and appended to quarantine.log. They count as
+    processed, contribute no rows, and are not retried.
+
+    encoder may also be a list of Encoders whose features are produced
+    together from one replay, see ChunkWriter's extra_features. The first
+    one is stored as the chunks' 'features', the others under
+    'extra_features', and all of them are part of the key and the layout,
+    e.g. processed/oneplane-v1+sevenplane-v1.
+
+    Layout: <data_dir>/processed/<encoder>-v<version>/<archive>/<key>*
+    """
+    def __init__(self, data_dir, encoder):
+        if not isinstance(encoder, (list, tuple)):
+            encoder = [encoder]
+        self.data_dir = data_dir
+        self.encoders = [(e.name(), e.version()) for e in encoder]
+        self.encoder_name, self.encoder_version = self.encoders[0]
+        self.root = os.path.join(data_dir, 'processed',
+                                 '+'.join('%s-v%s' % name_version for name_version in self.encoders))
+
+    def archive_dir(self, archive):
+        return os.path.join(self.root, archive.replace('.tar.gz', ''))
+
+    def shard_key(self, archive, game_list):
+        # A single encoder keeps the key it always had, so existing shards stay valid
+        if len(self.encoders) == 1:
+            content = json.dumps([archive, sorted(game_list),
+                                  self.encoder_name, self.encoder_version])
+        else:
+            content = json.dumps([archive, sorted(game_list), self.encoders])
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+
+    def shard_base(self, archive, key):
+        """Return the file base chunks of the shard should be written to."""
+        directory = self.archive_dir(archive)
+        # Pool workers may create it at the same time
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, key)
+
+    def completed_shards(self, archive):
+        """Return the records of all completed shards of an archive.
+
+        Records are read from disk on every call, as shards may have been
+        completed by worker processes in the meantime.
+        """
+        record_files = sorted(glob.glob(os.path.join(self.archive_dir(archive), '*.json')))
+        return [load_json(record_file) for record_file in record_files]
+
+    def missing_games(self, archive, game_list):
+        """Return the sorted indices of game_list not covered by any completed shard."""
+        done = set()
+        for record in self.completed_shards(archive):
+            done.update(int(index) for index in record['games'])
+            done.update(int(index) for index in record.get('failed', {}))
+        return sorted(set(game_list) - done)
+
+    def quarantine_path(self):
+        return os.path.join(self.root, 'quarantine.log')
+
+    def quarantine(self, archive, index, name, reason):
+        """Log a game that failed to process. Lines are archive, index, member name and reason."""
+        os.makedirs(self.root, exist_ok=True)
+        line = '\t'.join([archive, str(index), name, reason.replace('\n', ' ')]) + '\n'
+        with open(self.quarantine_path(), 'a') as f:
+            f.write(line)
+
+    def record_shard(self, archive, key, games, chunks, failed=None):
+        """Mark a shard as complete.
+
+        games  -- dict mapping game index to its [start, stop) shard rows
+        chunks -- the chunk list returned by ChunkWriter.close()
+        failed -- dict mapping game index to the reason it was quarantined
+        """
+        record = {
+            'archive': archive,
+            'key': key,
+            'encoder': self.encoder_name,
+            'encoder_version': self.encoder_version,
+            'games': dict((str(index), rows) for index, rows in games.items()),
+            'chunks': [self._relative_chunk(chunk) for chunk in chunks],
+            'failed': dict((str(index), reason) for index, reason in (failed or {}).items()),
+        }
+        if len(self.encoders) > 1:
+            record['encoders'] = self.encoders
+        save_json(self.shard_base(archive, key) + '.json', record)
+        return record
+
+    def _relative_chunk(self, chunk):
+        chunk = dict(chunk,
+                     features=os.path.relpath(chunk['features'], self.data_dir),
+                     labels=os.path.relpath(chunk['labels'], self.data_dir))
+        if 'extra_features' in chunk:
+            chunk['extra_features'] = dict(
+                (name, os.path.relpath(path, self.data_dir))
+                for name, path in chunk['extra_features'].items())
+        return chunk
+
+    def select(self, archive, game_list):
+        """Find the stored rows of the requested games.
+
+        Returns a list of chunk entries (dicts with keys 'archive',
+        'features', 'labels', 'ranges' and 'rows', plus 'extra_features'
+        with several encoders), where 'ranges' are the [start, stop) rows
+        within the chunk that belong to the requested games and 'rows' is
+        their total. Raises KeyError if a game hasn't been processed.
+        Quarantined games are skipped.
+
+        Every chunk file appears in one entry only, however the requested
+        games interleave across shards, so the number of entries stays
+        bounded by the number of chunks. Entries are listed in the order of
+        the lowest game index they hold and their ranges in row order, so
+        the result doesn't depend on the shard keys.
+        """
+        wanted = set(game_list)
+        games = []
+        for record in self.completed_shards(archive):
+            games.extend((int(index), rows, record) for index, rows in record['games'].items()
+                         if int(index) in wanted)
+            wanted.difference_update(int(index) for index in record['games'])
+            wanted.difference_update(int(index) for index in record.get('failed', {}))
+        if wanted:
+            raise KeyError('%s: games %s have not been processed' % (archive, sorted(wanted)))
+
+        selected = []
+        entries = {}
+        games.sort(key=lambda game: game[0])
+        for index, (start, stop), record in games:
+            chunk_start = 0
+            for chunk in record['chunks']:
+                chunk_stop = chunk_start + chunk['rows']
+                first, last = max(start, chunk_start) - chunk_start, min(stop, chunk_stop) - chunk_start
+                chunk_start = chunk_stop
+                if first >= last:
+                    continue
+                entry = entries.get(chunk['features'])
+                if entry is None:
+                    entry = {
+                        'archive': archive,
+                        'features': chunk['features'],
+                        'labels': chunk['labels'],
+                        'ranges': [],
+                        'rows': 0,
+                    }
+                    if 'extra_features' in chunk:
+                        entry['extra_features'] = chunk['extra_features']
+                    entries[chunk['features']] = entry
+                    selected.append(entry)
+                entry['ranges'].append([first, last])
+                entry['rows'] += last - first
+
+        # Adjacent games of a chunk share one range
+        for entry in selected:
+            ranges = []
+            for first, last in sorted(entry['ranges']):
+                if ranges and ranges[-1][1] == first:
+                    ranges[-1][1] = last
+                else:
+                    ranges.append([first, last])
+            entry['ranges'] = ranges
+        return selected
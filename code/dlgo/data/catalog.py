@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import absolute_import
+import os
+import re
+import sqlite3
+
+from dlgo.gosgf import read_main_line
+from dlgo.data.archive import iter_all_archive_games
+from dlgo.data.corpus import count_examples, root_text
+from dlgo.data.index_processor import KGSIndex
+
+__all__ = [
+    'GameCatalog',
+    'build_catalog',
+    'rank_level',
+]
+
+# Columns of the games table that can be used to filter and stratify
+COLUMNS = ('archive', 'game_index', 'year', 'size', 'handicap', 'komi', 'result', 'winner',
+           'black_rank', 'white_rank', 'black_level', 'white_level', 'date',
+           'num_moves', 'num_examples')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    archive TEXT NOT NULL,
+    game_index INTEGER NOT NULL,
+    year INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    handicap INTEGER NOT NULL,
+    komi REAL NOT NULL,
+    result TEXT NOT NULL,
+    winner TEXT NOT NULL,
+    black_rank TEXT NOT NULL,
+    white_rank TEXT NOT NULL,
+    black_level INTEGER,
+    white_level INTEGER,
+    date TEXT NOT NULL,
+    num_moves INTEGER NOT NULL,
+    num_examples INTEGER NOT NULL,
+    PRIMARY KEY (archive, game_index)
+);
+CREATE TABLE IF NOT EXISTS archives (
+    archive TEXT PRIMARY KEY,
+    year INTEGER NOT NULL,
+    num_games INTEGER NOT NULL,
+    num_failed INTEGER NOT NULL
+);
+"""
+
+_rank_re = re.compile(r'^\s*(\d+)\s*([kdp])', re.IGNORECASE)
+
+
+def rank_level(rank):
+    """Turn a KGS rank into a number: 'Nk' is -N, 'Nd' is N and 'Np' is 9 + N.
+
+    Returns None for an unknown rank such as '?' or ''.
+    """
+    m = _rank_re.match(rank)
+    if not m:
+        return None
+    number, kind = int(m.group(1)), m.group(2).lower()
+    if kind == 'k':
+        return -number
+    if kind == 'd':
+        return number
+    return 9 + number
+
+
+def _winner(result):
+    if result[:2].upper() == 'B+':
+        return 'b'
+    if result[:2].upper() == 'W+':
+        return 'w'
+    return ''
+
+
+class GameCatalog:
+    """Per-game metadata of the KGS archives in an SQLite database.
+
+    The games table holds one row per game, keyed by (archive, game_index)
+    as used by Sampler and GoDataProcessor, with the year of its archive,
+    board size, handicap, komi, result and winner ('b', 'w' or ''), ranks
+    as given in the SGF and as levels (see rank_level), date, number of
+    moves and number of training examples. The archives table lists the
+    archives that have been read completely.
+
+    Queries take an SQL condition on the columns in COLUMNS, e.g.
+    "size = 19 AND handicap = 0 AND black_level >= ?", with parameters
+    passed separately.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def archives(self):
+        """Return the names of the archives in the catalog."""
+        return [row[0] for row in self.connection.execute('SELECT archive FROM archives ORDER BY archive')]
+
+    def add_archive(self, data_dir, archive, year):
+        """Read every game of an archive into the catalog, replacing earlier rows for it.
+
+        Games that can't be read are skipped and counted. Returns the
+        number of games added.
+        """
+        rows = []
+        failed = 0
+        for game_index, name, sgf_content in iter_all_archive_games(os.path.join(data_dir, archive)):
+            if not name.endswith('.sgf'):
+                continue
+            try:
+                game = read_main_line(sgf_content)
+                handicap = game.get_handicap() or 0
+                komi = game.get_komi()
+                num_examples = count_examples(game, handicap)
+            except ValueError as e:
+                failed += 1
+                print('>>> Skipping %s %s: %s' % (archive, name, e))
+                continue
+            result = game.get_result() or ''
+            black_rank, white_rank = root_text(game, b'BR'), root_text(game, b'WR')
+            rows.append((archive, game_index, year, game.size, handicap, komi,
+                         result, _winner(result), black_rank, white_rank,
+                         rank_level(black_rank), rank_level(white_rank),
+                         root_text(game, b'DT'), len(game), num_examples))
+        with self.connection:
+            self.connection.execute('DELETE FROM games WHERE archive = ?', (archive,))
+            self.connection.executemany(
+                'INSERT INTO games VALUES (%s)' % ', '.join(['?'] * len(COLUMNS)), rows)
+            self.connection.execute('INSERT OR REPLACE INTO archives VALUES (?, ?, ?, ?)',
+                                    (archive, year, len(rows), failed))
+        return len(rows)
+
+    def select(self, where=None, params=(), columns=()):
+        """Return (archive, game_index) of the games matching where, in catalog order.
+
+        With columns, the values of those columns are appended to each row.
+        """
+        for column in columns:
+            if column not in COLUMNS:
+                raise ValueError('unknown catalog column %s' % column)
+        query = 'SELECT %s FROM games' % ', '.join(('archive', 'game_index') + tuple(columns))
+        if where:
+            query += ' WHERE ' + where
+        query += ' ORDER BY archive, game_index'
+        return [tuple(row) for row in self.connection.execute(query, params)]
+
+    def count(self, where=None, params=()):
+        """Return the number of games and of training examples matching where."""
+        query = 'SELECT COUNT(*), COALESCE(SUM(num_examples), 0) FROM games'
+        if where:
+            query += ' WHERE ' + where
+        num_games, num_examples = self.connection.execute(query, params).fetchone()
+        return num_games, num_examples
+
+    def num_examples(self, games):
+        """Return the number of training examples in a list of (archive, game_index) pairs."""
+        with self.connection:
+            self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS selection '
+                                    '(archive TEXT, game_index INTEGER)')
+            self.connection.execute('DELETE FROM selection')
+            self.connection.executemany('INSERT INTO selection VALUES (?, ?)', games)
+            total, = self.connection.execute(
+                'SELECT COALESCE(SUM(num_examples), 0) FROM selection '
+                'JOIN games USING (archive, game_index)').fetchone()
+        return total
+
+
+def build_catalog(data_dir='data', catalog_path=None, index=None):
+    """Add the downloaded archives listed in the KGS index to a catalog.
+
+    Parameters:
+    -----------
+    data_dir: directory holding the downloaded archives
+    catalog_path: SQLite file, <data_dir>/catalog.sqlite by default
+    index: KGSIndex, read from data_dir by default
+
+    Archives already in the catalog are not read again, so the catalog
+    can be brought up to date after more archives have been downloaded.
+    Returns the GameCatalog.
+    """
+    if catalog_path is None:
+        catalog_path = os.path.join(data_dir, 'catalog.sqlite')
+    if index is None:
+        index = KGSIndex(data_directory=data_dir)
+    catalog = GameCatalog(catalog_path)
+    done = set(catalog.archives())
+    for file_info in index.file_info:
+        archive = file_info['filename']
+        if archive in done or not os.path.isfile(os.path.join(data_dir, archive)):
+            continue
+        num_games = catalog.add_archive(data_dir, archive, file_info['year'])
+        print('>>> Catalogued %d games of %s' % (num_games, archive))
+    return catalog
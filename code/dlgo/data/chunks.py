@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import numpy as np
+
+__all__ = [
+    'ChunkWriter',
+    'consolidate_chunks',
+]
+
+
+class ChunkWriter:
+    """Buffer encoded positions and store them as fixed-size .npy chunks.
+
+    Rows are written one at a time while a game is replayed, so the total
+    number of examples doesn't have to be known in advance. Whenever the
+    buffer is full it is saved as a pair of files
+
+        <file_base>_features_<n>.npy
+        <file_base>_labels_<n>.npy
+
+    and reused for the next chunk. The chunks attribute lists the written
+    files as dicts with keys 'features', 'labels' and 'rows'.
+
+    extra_features lists further feature stores as (name, shape, dtype)
+    tuples, for positions encoded in several ways at once. Their rows are
+    written alongside, share the label files and are saved as
+
+        <file_base>_<name>_features_<n>.npy
+
+    with the files of each chunk under 'extra_features', keyed by name.
+
+    Features are stored in the compact dtype the encoder asks for (int8 for
+    all planes we have) and labels, being point indices, as int16. Each .npy
+    header records its dtype; conversion to float32 is left to whoever
+    builds the training batches.
+    """
+    def __init__(self, file_base, feature_shape, feature_dtype='int8',
+                 label_dtype='int16', chunksize=1024, extra_features=()):
+        self.file_base = file_base
+        self.chunksize = chunksize
+        self.features = np.zeros((chunksize,) + tuple(feature_shape), dtype=feature_dtype)
+        self.labels = np.zeros((chunksize,), dtype=label_dtype)
+        self.extra_names = [name for name, shape, dtype in extra_features]
+        self.extra_features = [np.zeros((chunksize,) + tuple(shape), dtype=dtype)
+                               for name, shape, dtype in extra_features]
+        self.num_chunks = 0
+        self.num_rows = 0
+        self.chunks = []
+        self._row = 0
+
+    def write(self, feature, label, *extra_features):
+        """Append a single encoded position and its label, then one row per extra feature store."""
+        self.features[self._row] = feature
+        self.labels[self._row] = label
+        for buffer, extra in zip(self.extra_features, extra_features):
+            buffer[self._row] = extra
+        self._row += 1
+        self.num_rows += 1
+        if self._row == self.chunksize:
+            self._flush()
+
+    def write_many(self, features, labels, *extra_features):
+        """Append the rows of an array of encoded positions and their labels.
+
+        extra_features are the same positions for each extra feature store.
+        """
+        start = 0
+        while start < len(labels):
+            count = min(len(labels) - start, self.chunksize - self._row)
+            self.features[self._row:self._row + count] = features[start:start + count]
+            self.labels[self._row:self._row + count] = labels[start:start + count]
+            for buffer, extra in zip(self.extra_features, extra_features):
+                buffer[self._row:self._row + count] = extra[start:start + count]
+            start += count
+            self._row += count
+            self.num_rows += count
+            if self._row == self.chunksize:
+                self._flush()
+
+    def close(self):
+        """Finish writing, storing any remaining rows as a last, shorter chunk.
+
+        Returns the list of written chunks, see the chunks attribute.
+        """
+        if self._row > 0:
+            self._flush()
+        return self.chunks
+
+    def _flush(self):
+        feature_file = self.file_base + '_features_%d.npy' % self.num_chunks
+        label_file = self.file_base + '_labels_%d.npy' % self.num_chunks
+        np.save(feature_file, self.features[:self._row])
+        np.save(label_file, self.labels[:self._row])
+        chunk = {'features': feature_file, 'labels': label_file, 'rows': self._row}
+        if self.extra_names:
+            chunk['extra_features'] = {}
+            for name, buffer in zip(self.extra_names, self.extra_features):
+                extra_file = self.file_base + '_%s_features_%d.npy' % (name, self.num_chunks)
+                np.save(extra_file, buffer[:self._row])
+                chunk['extra_features'][name] = extra_file
+        self.chunks.append(chunk)
+        self.num_chunks += 1
+        self._row = 0
+
+
+def consolidate_chunks(chunk_files, feature_path, label_path):
+    """Concatenate chunk files into a single pair of memory-mapped .npy files.
+
+    Parameters:
+    -----------
+    chunk_files: list of (feature file, label file, ranges) tuples, where
+        ranges are the [start, stop) rows of the chunk to copy
+    feature_path: target .npy file for all features
+    label_path: target .npy file for all labels, or None to copy only the
+        features, e.g. of a further feature store sharing the labels
+
+    The selected row counts size the targets, which are then
+    preallocated with np.lib.format.open_memmap and filled one chunk at a
+    time. Features keep their stored dtype and labels stay sparse point
+    indices, so neither the full dataset nor one-hot labels are ever held in
+    memory. Returns the (features, labels) memmaps, labels being None if
+    label_path is.
+    """
+    chunks = []
+    for feature_file, label_file, ranges in chunk_files:
+        chunks.append((np.load(feature_file, mmap_mode='r'),
+                       None if label_path is None else np.load(label_file, mmap_mode='r'),
+                       ranges))
+    if not chunks:
+        raise ValueError('no processed chunks to consolidate')
+    num_rows = sum(stop - start for x, y, ranges in chunks for start, stop in ranges)
+    x, y, ranges = chunks[0]
+    features = np.lib.format.open_memmap(
+        feature_path, mode='w+', dtype=x.dtype, shape=(num_rows,) + x.shape[1:])
+    labels = None
+    if label_path is not None:
+        labels = np.lib.format.open_memmap(
+            label_path, mode='w+', dtype=y.dtype, shape=(num_rows,))
+    row = 0
+    for x, y, ranges in chunks:
+        for start, stop in ranges:
+            features[row:row + stop - start] = x[start:stop]
+            if labels is not None:
+                labels[row:row + stop - start] = y[start:stop]
+            row += stop - start
+    features.flush()
+    if labels is not None:
+        labels.flush()
+    return features, labels
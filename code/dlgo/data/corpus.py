@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import absolute_import
+import glob
+import os
+from array import array
+
+import numpy as np
+
+from dlgo.goboard_fast import Board, GameState, Move
+from dlgo.gosgf import read_main_line, sgf_grammar
+from dlgo.gotypes import Player, Point
+from dlgo.encoders.incremental import IncrementalEncoding
+from dlgo.data.archive import iter_all_archive_games
+from dlgo.data.manifest import load_json, save_json
+
+__all__ = [
+    'CorpusDataGenerator',
+    'CorpusWriter',
+    'GameCorpus',
+    'build_corpus',
+    'count_examples',
+    'root_text',
+]
+
+CORPUS_VERSION = 1
+
+# Per-game metadata, stored as one .npy file each: name -> dtype (None: unicode)
+_METADATA = [
+    ('sizes', 'int8'),
+    ('handicaps', 'int8'),
+    ('komis', 'float32'),
+    ('num_examples', 'int32'),
+    ('game_indices', 'int32'),
+    ('archives', None),
+    ('results', None),
+    ('black_ranks', None),
+    ('white_ranks', None),
+    ('dates', None),
+]
+
+
+def root_text(game, identifier):
+    """Return a simpletext root property of a Main_line as a string, or '' if it isn't present."""
+    try:
+        raw = game.root[identifier][0]
+    except KeyError:
+        return ''
+    return sgf_grammar.simpletext_value(raw).decode('ISO-8859-1')
+
+
+def count_examples(game, handicap):
+    """Return the number of training examples GoDataProcessor takes from a Main_line.
+
+    Every move that places a stone is an example, except the first move of
+    a game without handicap.
+    """
+    plays = np.frombuffer(game.moves, dtype=np.int16) >= 0
+    num_examples = int(plays[1:].sum())
+    if handicap and len(plays) and plays[0]:
+        num_examples += 1
+    return num_examples
+
+
+class CorpusWriter:
+    """Collect the main lines of many games into a compact corpus.
+
+    A move takes two bytes: moves are stored in one int16 array as
+    +(point + 1) for black and -(point + 1) for white, where point is
+    row * size + col with the row counted from the bottom, and a pass is
+    point size * size. Setup stones are stored the same way. Offsets into
+    both arrays and per-game metadata (size, handicap, komi, number of
+    training examples, source archive and index, result, ranks and date)
+    are stored alongside as .npy files, so the whole corpus can be
+    memory-mapped by GameCorpus.
+
+    corpus.json is written last and marks the corpus as complete.
+    """
+    def __init__(self, corpus_dir):
+        self.corpus_dir = corpus_dir
+        self.moves = array('h')
+        self.offsets = array('q', [0])
+        self.setup = array('h')
+        self.setup_offsets = array('q', [0])
+        self.metadata = dict((name, []) for name, dtype in _METADATA)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def add_game(self, game, archive='', game_index=-1):
+        """Add a game, given as the Main_line returned by read_main_line().
+
+        Raises ValueError if the game's root properties are malformed; the
+        corpus is left unchanged in that case.
+        """
+        size = game.size
+        handicap = game.get_handicap() or 0
+        komi = game.get_komi()
+        black, white, empty = game.get_setup_stones()
+
+        moves = np.frombuffer(game.moves, dtype=np.int16).astype(np.int32)
+        points = np.where(moves < 0, size * size, moves) + 1
+        white_moves = np.frombuffer(game.colours.encode('ascii'), dtype=np.uint8) == ord('w')
+        codes = np.where(white_moves, -points, points)
+        num_examples = count_examples(game, handicap)
+
+        self.moves.extend(codes.astype(np.int16).tolist())
+        self.offsets.append(len(self.moves))
+        for sign, stones in ((1, black), (-1, white)):
+            self.setup.extend(sign * (row * size + col + 1) for row, col in sorted(stones))
+        self.setup_offsets.append(len(self.setup))
+        for name, value in (('sizes', size), ('handicaps', handicap), ('komis', komi),
+                            ('num_examples', num_examples), ('game_indices', game_index),
+                            ('archives', archive),
+                            ('results', game.get_result() or ''),
+                            ('black_ranks', root_text(game, b'BR')),
+                            ('white_ranks', root_text(game, b'WR')),
+                            ('dates', root_text(game, b'DT'))):
+            self.metadata[name].append(value)
+
+    def close(self):
+        if not os.path.isdir(self.corpus_dir):
+            os.makedirs(self.corpus_dir)
+        arrays = [('moves', np.array(self.moves, dtype=np.int16)),
+                  ('offsets', np.array(self.offsets, dtype=np.int64)),
+                  ('setup', np.array(self.setup, dtype=np.int16)),
+                  ('setup_offsets', np.array(self.setup_offsets, dtype=np.int64))]
+        for name, dtype in _METADATA:
+            values = self.metadata[name]
+            arrays.append((name, np.array(values, dtype=dtype) if dtype else np.array(values, dtype=str)))
+        for name, values in arrays:
+            path = os.path.join(self.corpus_dir, name + '.npy')
+            tmp_path = '%s.%d.tmp.npy' % (path[:-len('.npy')], os.getpid())
+            np.save(tmp_path, values)
+            os.replace(tmp_path, path)
+        save_json(os.path.join(self.corpus_dir, 'corpus.json'), {
+            'version': CORPUS_VERSION,
+            'num_games': len(self),
+            'num_moves': len(self.moves),
+            'num_examples': int(sum(self.metadata['num_examples'])),
+        })
+        return GameCorpus(self.corpus_dir)
+
+
+def build_corpus(data_dir, corpus_dir=None, archives=None):
+    """Read every game of the given KGS archives into a corpus.
+
+    Parameters:
+    -----------
+    data_dir: directory holding the downloaded archives
+    corpus_dir: where to store the corpus, <data_dir>/corpus by default
+    archives: archive file names; all KGS-*.tar.gz in data_dir by default
+
+    Games that can't be read are skipped and counted. Returns the GameCorpus.
+    """
+    if corpus_dir is None:
+        corpus_dir = os.path.join(data_dir, 'corpus')
+    if archives is None:
+        archives = [os.path.basename(path) for path in glob.glob(os.path.join(data_dir, 'KGS-*.tar.gz'))]
+    writer = CorpusWriter(corpus_dir)
+    failed = 0
+    for archive in sorted(archives):
+        # Every game is needed in order, so stream the archive once
+        for game_index, name, sgf_content in iter_all_archive_games(os.path.join(data_dir, archive)):
+            if not name.endswith('.sgf'):
+                continue
+            try:
+                writer.add_game(read_main_line(sgf_content), archive, game_index)
+            except ValueError as e:
+                failed += 1
+                print('>>> Skipping %s %s: %s' % (archive, name, e))
+    print('>>> Corpus of %d games, %d skipped' % (len(writer), failed))
+    return writer.close()
+
+
+class GameCorpus:
+    """Memory-mapped access to a corpus written by CorpusWriter.
+
+    Games are numbered 0 .. len(corpus) - 1 in the order they were added.
+    Positions are not stored: replay() and encode_game() recreate them,
+    so any encoder can be used without reprocessing the games.
+    """
+    def __init__(self, corpus_dir):
+        self.corpus_dir = corpus_dir
+        self.info = load_json(os.path.join(corpus_dir, 'corpus.json'))
+        if self.info['version'] != CORPUS_VERSION:
+            raise ValueError('%s: unsupported corpus version %s' % (corpus_dir, self.info['version']))
+        for name in ['moves', 'offsets', 'setup', 'setup_offsets'] + [name for name, dtype in _METADATA]:
+            setattr(self, name, np.load(os.path.join(corpus_dir, name + '.npy'), mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def find(self, archive, game_index):
+        """Return the id of the game read from the given archive and index."""
+        ids = np.flatnonzero((self.archives == archive) & (self.game_indices == game_index))
+        if len(ids) == 0:
+            raise KeyError('%s has no game %s in the corpus' % (archive, game_index))
+        return int(ids[0])
+
+    def game_moves(self, game_id):
+        """Return the moves of a game as a list of (player, point) pairs, point None for a pass."""
+        size = int(self.sizes[game_id])
+        moves = []
+        for code in self.moves[self.offsets[game_id]:self.offsets[game_id + 1]].tolist():
+            player = Player.black if code > 0 else Player.white
+            row, col = divmod(abs(code) - 1, size)
+            moves.append((player, Point(row + 1, col + 1) if row < size else None))
+        return moves
+
+    def initial_state(self, game_id):
+        """Return the game state before the first move, and whether the first move counts as played.
+
+        As in GoDataProcessor.get_handicap(), setup stones are only placed
+        in handicap games, AB stones as black and AW stones as white, and
+        those games then start with white to play.
+        """
+        size = int(self.sizes[game_id])
+        game_state = GameState.new_game(size)
+        if not self.handicaps[game_id]:
+            return game_state, False
+        board = Board(size, size)
+        for code in self.setup[self.setup_offsets[game_id]:self.setup_offsets[game_id + 1]].tolist():
+            row, col = divmod(abs(code) - 1, size)
+            board.place_stone(Player.black if code > 0 else Player.white, Point(row + 1, col + 1))
+        return GameState(board, Player.white, None, None), True
+
+    def replay(self, game_id):
+        """Yield (game_state, point) for every move that GoDataProcessor turns into an example.
+
+        game_state is the position before the move; the game is advanced
+        over passes and the first move of games without handicap as well.
+        """
+        game_state, first_move_done = self.initial_state(game_id)
+        for player, point in self.game_moves(game_id):
+            if point is not None:
+                if first_move_done:
+                    yield game_state, point
+                move = Move.play(point)
+            else:
+                move = Move.pass_turn()
+            game_state = game_state.apply_move(move)
+            first_move_done = True
+
+    def encode_game(self, game_id, encoder):
+        """Return the (features, labels) arrays of a game, in the encoder's dtype and int16.
+
+        Encoders that support it encode the positions incrementally while
+        the game is replayed on a single board.
+        """
+        num_examples = int(self.num_examples[game_id])
+        features = np.zeros((num_examples,) + tuple(encoder.shape()), dtype=encoder.dtype())
+        labels = np.zeros((num_examples,), dtype=np.int16)
+        if not encoder.is_incremental():
+            for row, (game_state, point) in enumerate(self.replay(game_id)):
+                encoder.encode_into(game_state, features[row])
+                labels[row] = encoder.encode_point(point)
+            return features, labels
+
+        game_state, first_move_done = self.initial_state(game_id)
+        encoding = IncrementalEncoding(encoder, game_state.board, game_state.next_player)
+        row = 0
+        for player, point in self.game_moves(game_id):
+            if point is not None:
+                if first_move_done:
+                    encoding.encode_into(features[row])
+                    labels[row] = encoder.encode_point(point)
+                    row += 1
+                move = Move.play(point)
+            else:
+                move = Move.pass_turn()
+            encoding.apply_move(move)
+            first_move_done = True
+        return features, labels
+
+
+class CorpusDataGenerator:
+    """Draw training batches from a GameCorpus, encoding positions on the fly.
+
+    Parameters:
+    -----------
+    corpus: the GameCorpus to read games from
+    encoder: the Encoder to use
+    game_ids: ids of the games to use, all games of the encoder's board size by default
+    seed: seed of the shuffling
+    shuffle_buffer: number of positions shuffled together
+
+    Games are visited in a new random order each epoch. Their positions are
+    collected in a buffer of about shuffle_buffer positions, which is
+    shuffled before batches are drawn from it, so a batch mixes positions of
+    many games. It can be used wherever a DataGenerator is.
+    """
+    def __init__(self, corpus, encoder, game_ids=None, seed=None, shuffle_buffer=4096):
+        self.corpus = corpus
+        self.encoder = encoder
+        if game_ids is None:
+            game_ids = np.flatnonzero(np.asarray(corpus.sizes) == encoder.board_width)
+        self.game_ids = np.asarray(game_ids, dtype=np.int64)
+        self.num_samples = int(np.asarray(corpus.num_examples)[self.game_ids].sum())
+        self.shuffle_buffer = shuffle_buffer
+        self._rng = np.random.RandomState(seed)
+
+    def get_num_samples(self, batch_size=128, num_classes=19 * 19):
+        return self.num_samples
+
+    def _batches(self, features, labels, batch_size, num_classes):
+        order = self._rng.permutation(len(labels))
+        for start in range(0, len(order) - batch_size + 1, batch_size):
+            rows = order[start:start + batch_size]
+            y_batch = np.zeros((batch_size, num_classes), dtype='float32')
+            y_batch[np.arange(batch_size), labels[rows]] = 1
+            yield features[rows].astype('float32'), y_batch
+        kept = order[len(order) - len(order) % batch_size:]
+        features[:len(kept)] = features[kept]
+        labels[:len(kept)] = labels[kept]
+
+    def _generate(self, batch_size, num_classes):
+        capacity = max(self.shuffle_buffer, batch_size) + 1024
+        features = np.zeros((capacity,) + tuple(self.encoder.shape()), dtype=self.encoder.dtype())
+        labels = np.zeros((capacity,), dtype=np.int64)
+        size = 0
+        for game_id in self._rng.permutation(self.game_ids):
+            game_features, game_labels = self.corpus.encode_game(game_id, self.encoder)
+            if size + len(game_labels) > capacity:
+                capacity = size + len(game_labels)
+                features = np.concatenate([features[:size], game_features])
+                labels = np.concatenate([labels[:size], game_labels])
+            else:
+                features[size:size + len(game_labels)] = game_features
+                labels[size:size + len(game_labels)] = game_labels
+            size += len(game_labels)
+            if size >= self.shuffle_buffer:
+                for batch in self._batches(features[:size], labels[:size], batch_size, num_classes):
+                    yield batch
+                size %= batch_size
+        for batch in self._batches(features[:size], labels[:size], batch_size, num_classes):
+            yield batch
+
+    def generate(self, batch_size=128, num_classes=19 * 19):
+        while True:
+            for item in self._generate(batch_size, num_classes):
+                yield item
@@ -1,51 +1,128 @@
 # -*- coding: utf-8 -*-
 
 # tag::data_generator[]
-import glob
+import threading
+import time
+from collections import deque
+
 import numpy as np
-from keras.utils import to_categorical
+from six.moves import queue
+
+from dlgo.data.manifest import chunk_features, feature_shape, load_manifest
 
 
 class DataGenerator:
-    def __init__(self, data_directory, samples):
+    def __init__(self, data_directory, samples, data_type='train', manifest=None,
+                 seed=None, num_buffers=16, encoder=None):
         self.data_directory = data_directory
         self.samples = samples
+        self.data_type = data_type
+        if manifest is None:
+            manifest = load_manifest(data_directory, data_type)
+        self.manifest = manifest
+        # 複数のエンコーダで処理したデータでは、encoderで特徴量を選ぶ(既定は最初のエンコーダ)
+        self.encoder = encoder
+        self.feature_shape = feature_shape(manifest, encoder)
 
         # ジェネレータは、先にサンプリングした一連のファイルにアクセスする
         self.files = set(file_name for file_name, index in samples)  # <1>
-        self.num_samples = None
+        self.chunks = [chunk for chunk in manifest['chunks'] if chunk['archive'] in self.files]
+        self.num_samples = sum(chunk['rows'] for chunk in self.chunks)
+        self.num_buffers = num_buffers
+        self._rng = np.random.RandomState(seed)
+        self._features = []
+        self._labels = []
+        self._rows = []
+        self._offsets = None
+        self._buffers = []
+        self._next_buffer = 0
 
     # アプリケーションによっては、どれくらいのサンプルがあるか知る必要があるかもしれない
     def get_num_samples(self, batch_size=128, num_classes=19 * 19):  # <2>
-        if self.num_samples is not None:
-            return self.num_samples
-        else:
-            self.num_samples = 0
-            for X, y in self._generate(batch_size=batch_size, num_classes=num_classes):
-                self.num_samples += X.shape[0]
-            return self.num_samples
-# <1> Our generator has access to a set of files that we sampled earlier.
-# <2> Depending on the application, we may need to know how many examples we have.
+        return self.num_samples
+# <1> Our generator has access to a set of files that we sampled earlier, listed in the manifest of its data type.
+# <2> Depending on the application, we may need to know how many examples we have. The manifest tells us without reading any data.
 # end::data_generator[]
 
+    def _load_chunks(self):
+        """Memory-map all chunk files listed in the manifest and index their selected rows.
+
+        Only the .npy headers are read here; rows are paged in when a batch
+        gathers them.
+        """
+        for chunk in self.chunks:
+            feature_file = chunk_features(self.manifest, chunk, self.encoder)
+            self._features.append(np.load(self.data_directory + '/' + feature_file, mmap_mode='r'))
+            self._labels.append(np.load(self.data_directory + '/' + chunk['labels'], mmap_mode='r'))
+            self._rows.append(np.concatenate(
+                [np.arange(start, stop) for start, stop in chunk['ranges']]))
+        sizes = [chunk['rows'] for chunk in self.chunks]
+        self._offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+
+    def _batch_buffers(self, batch_size, num_classes):
+        """Return the next pair of preallocated (features, one-hot labels) buffers.
+
+        Buffers are handed out round-robin, so a yielded batch stays valid
+        until num_buffers - 1 further batches have been drawn. That leaves
+        room for the queue Keras keeps in front of fit_generator.
+        """
+        if not self._buffers or self._buffers[0][0].shape[0] != batch_size \
+                or self._buffers[0][1].shape[1] != num_classes:
+            feature_shape = (batch_size,) + self.feature_shape
+            self._buffers = [
+                (np.zeros(feature_shape, dtype='float32'),
+                 np.zeros((batch_size, num_classes), dtype='float32'))
+                for _ in range(self.num_buffers)]
+            self._next_buffer = 0
+        buffers = self._buffers[self._next_buffer]
+        self._next_buffer = (self._next_buffer + 1) % self.num_buffers
+        return buffers
+
+    def epoch_order(self):
+        """Return a new random permutation of the sample rows for one epoch.
+
+        The chunk files are memory-mapped on first use.
+        """
+        if self._offsets is None:
+            self._load_chunks()
+        return self._rng.permutation(self.num_samples)
+
+    def fill_batch(self, rows, x_batch, y_batch):
+        """Gather the given row indices, e.g. a slice of epoch_order(), into the batch buffers.
+
+        Rows are sorted so that all rows of one chunk are copied with a
+        single fancy-indexing read. Features are cast to float32 and labels
+        expanded to one-hot vectors as they are written into the buffers.
+        This only reads the chunks, so several threads may fill batches at
+        once.
+        """
+        if self._offsets is None:
+            self._load_chunks()
+        rows = np.sort(rows)
+        chunk_ids = np.searchsorted(self._offsets, rows, side='right') - 1
+        labels = np.empty(len(rows), dtype=np.int64)
+        starts = np.flatnonzero(np.diff(chunk_ids)) + 1
+        for start, stop in zip(np.concatenate([[0], starts]),
+                               np.concatenate([starts, [len(rows)]])):
+            chunk = chunk_ids[start]
+            local_rows = self._rows[chunk][rows[start:stop] - self._offsets[chunk]]
+            x_batch[start:stop] = self._features[chunk][local_rows]
+            labels[start:stop] = self._labels[chunk][local_rows]
+        y_batch.fill(0)
+        y_batch[np.arange(len(rows)), labels] = 1
+
 # tag::private_generate[]
     # 囲碁データの次のバッチを生成してyieldするプライベートメソッド
     def _generate(self, batch_size, num_classes):
-        for zip_file_name in self.files:
-            file_name = zip_file_name.replace('.tar.gz', '') + 'train'
-            base = self.data_directory + '/' + file_name + '_features_*.npy'
-            for feature_file in glob.glob(base):
-                label_file = feature_file.replace('features', 'labels')
-                x = np.load(feature_file)
-                y = np.load(label_file)
-                x = x.astype('float32')
-                y = to_categorical(y.astype(int), num_classes)
-                while x.shape[0] >= batch_size:
-                    x_batch, x = x[:batch_size], x[batch_size:]
-                    y_batch, y = y[:batch_size], y[batch_size:]
-                    yield x_batch, y_batch  # <1>
-
-# <1> We return or "yield" batches of data as we go.
+        # エポックごとに全てのファイルをまたいでサンプルをシャッフルする
+        order = self.epoch_order()  # <1>
+        for start in range(0, self.num_samples - batch_size + 1, batch_size):
+            x_batch, y_batch = self._batch_buffers(batch_size, num_classes)
+            self.fill_batch(order[start:start + batch_size], x_batch, y_batch)
+            yield x_batch, y_batch  # <2>
+
+# <1> Each epoch shuffles the sample indices across all chunk files.
+# <2> We return or "yield" batches of data as we go, gathered into reusable buffers.
 # end::private_generate[]
 
 # tag::generate[]
@@ -55,3 +132,109 @@ class DataGenerator:
             for item in self._generate(batch_size, num_classes):
                 yield item
 # end::generate[]
+
+
+class PrefetchingDataGenerator:
+    """Wrap a DataGenerator and prepare its batches on background threads.
+
+    Parameters:
+    -----------
+    generator: the DataGenerator to draw batches from
+    workers: number of threads gathering batches
+    queue_depth: maximum number of ready batches waiting for the consumer
+
+    Workers take batch positions of the epoch's permutation from a shared
+    task list, gather the rows into one of a fixed pool of buffers and put
+    it on a bounded queue. Disk reads, dtype conversion and one-hot
+    expansion therefore overlap with training. As with DataGenerator, a
+    yielded batch stays valid until generator.num_buffers - 1 further
+    batches have been drawn.
+
+    stall_time accumulates the seconds the consumer spent waiting for a
+    batch; if it grows noticeably, add workers.
+    """
+    def __init__(self, generator, workers=2, queue_depth=8):
+        self.generator = generator
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.stall_time = 0.0
+        self.num_batches = 0
+
+    def get_num_samples(self, batch_size=128, num_classes=19 * 19):
+        return self.generator.get_num_samples(batch_size, num_classes)
+
+    def stats(self):
+        """Return the number of batches served and the total consumer stall time."""
+        return {
+            'batches': self.num_batches,
+            'stall_time': self.stall_time,
+            'stall_time_per_batch': self.stall_time / max(1, self.num_batches),
+        }
+
+    def generate(self, batch_size=128, num_classes=19 * 19):
+        while True:
+            for item in self._generate(batch_size, num_classes):
+                yield item
+
+    def _generate(self, batch_size, num_classes):
+        generator = self.generator
+        order = generator.epoch_order()
+        tasks = queue.Queue()
+        for start in range(0, generator.num_samples - batch_size + 1, batch_size):
+            tasks.put(start)
+        num_tasks = tasks.qsize()
+
+        keep = generator.num_buffers - 1
+        feature_shape = (batch_size,) + generator.feature_shape
+        free = queue.Queue()
+        for _ in range(self.queue_depth + self.workers + keep + 1):
+            free.put((np.zeros(feature_shape, dtype='float32'),
+                      np.zeros((batch_size, num_classes), dtype='float32')))
+        ready = queue.Queue(maxsize=self.queue_depth)
+        stop = threading.Event()
+
+        def wait_for(action):
+            # Poll, so that workers notice when the consumer has gone away.
+            while not stop.is_set():
+                try:
+                    return action(timeout=0.1)
+                except (queue.Empty, queue.Full):
+                    pass
+
+        def work():
+            try:
+                while not stop.is_set():
+                    try:
+                        start = tasks.get_nowait()
+                    except queue.Empty:
+                        return
+                    buffers = wait_for(free.get)
+                    if buffers is None:
+                        return
+                    x_batch, y_batch = buffers
+                    generator.fill_batch(order[start:start + batch_size], x_batch, y_batch)
+                    wait_for(lambda timeout: ready.put(buffers, timeout=timeout))
+            except Exception as e:
+                wait_for(lambda timeout: ready.put(e, timeout=timeout))
+
+        threads = [threading.Thread(target=work) for _ in range(self.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        in_use = deque()
+        try:
+            for _ in range(num_tasks):
+                waiting_since = time.time()
+                item = ready.get()
+                self.stall_time += time.time() - waiting_since
+                if isinstance(item, Exception):
+                    raise item
+                self.num_batches += 1
+                in_use.append(item)
+                if len(in_use) > keep:
+                    free.put(in_use.popleft())
+                yield item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
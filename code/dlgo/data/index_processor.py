@@ -5,21 +5,97 @@ from __future__ import print_function
 from __future__ import absolute_import
 import os
 import sys
-import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
 import six
-if sys.version_info[0] == 3:
-    from urllib.request import urlopen, urlretrieve
-else:
-    from urllib import urlopen, urlretrieve
+from dlgo.data.manifest import load_json, save_json
 
 
-def worker(url_and_target):  # Parallelize data download via multiprocessing
+class DownloadCancelled(Exception):
+    """Raised by download_file when its stop event is set."""
+
+
+class DownloadProgress:
+    """Thread-safe counter of finished files and received bytes."""
+    def __init__(self, num_files):
+        self.num_files = num_files
+        self.files_done = 0
+        self.bytes_done = 0
+        self._lock = threading.Lock()
+
+    def add_bytes(self, num_bytes):
+        with self._lock:
+            self.bytes_done += num_bytes
+
+    def file_done(self, target_path):
+        with self._lock:
+            self.files_done += 1
+            print('>>> Downloaded %s (%d/%d files, %.1f MB)' % (
+                target_path, self.files_done, self.num_files, self.bytes_done / 1e6))
+
+
+def download_file(url, target_path, progress=None, chunk_size=1 << 16, stop=None, timeout=60):
+    """Download url to target_path, resuming a previously interrupted download.
+
+    Data goes to target_path + '.part' first. If that file exists, only the
+    remaining bytes are requested with an HTTP Range header; servers that
+    ignore the header send the whole file again, which then replaces the
+    partial one. Once the received size matches the size announced by the
+    server, the file is renamed to target_path atomically, so a file at
+    target_path is always complete.
+
+    stop is an optional threading.Event checked between chunks; once it is
+    set the download ends with DownloadCancelled, keeping the partial file
+    to resume from. timeout, in seconds, applies to every socket operation.
+    """
+    part_path = target_path + '.part'
+    offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+    request = Request(url)
+    if offset:
+        request.add_header('Range', 'bytes=%d-' % offset)
+    try:
+        response = urlopen(request, timeout=timeout)
+    except HTTPError as e:
+        if e.code != 416 or not offset:
+            raise
+        # Range not satisfiable: the partial file is unusable, start over
+        os.remove(part_path)
+        return download_file(url, target_path, progress, chunk_size, stop, timeout)
+
     try:
-        (url, target_path) = url_and_target
-        print('>>> Downloading ' + target_path)
-        urlretrieve(url, target_path)
-    except (KeyboardInterrupt, SystemExit):
-        print('>>> Exiting child process')
+        if offset and response.getcode() == 206:
+            content_range = response.headers.get('Content-Range', '')
+            total = content_range.rsplit('/', 1)[-1]
+            mode = 'ab'
+        else:
+            total = response.headers.get('Content-Length')
+            offset = 0
+            mode = 'wb'
+        total = int(total) if total and total != '*' else None
+
+        size = offset
+        with open(part_path, mode) as part_file:
+            while True:
+                if stop is not None and stop.is_set():
+                    raise DownloadCancelled(url)
+                data = response.read(chunk_size)
+                if not data:
+                    break
+                part_file.write(data)
+                size += len(data)
+                if progress is not None:
+                    progress.add_bytes(len(data))
+    finally:
+        response.close()
+
+    if total is not None and size != total:
+        raise IOError('%s: received %d of %d bytes' % (url, size, total))
+    os.replace(part_path, target_path)
+    if progress is not None:
+        progress.file_done(target_path)
+    return target_path
 
 
 class KGSIndex:
@@ -35,16 +111,29 @@ class KGSIndex:
         kgs_url: URL with links to zip files of games
         index_page: Name of local html file of kgs_url
         data_directory: name of directory relative to current path to store SGF data
+
+        The parsed index is cached as JSON next to index_page and only
+        rebuilt when the html page is newer, so creating an index is cheap.
+        Still, create it once and share it, e.g. with Sampler.
         """
         self.kgs_url = kgs_url
         self.index_page = index_page
+        self.index_cache = os.path.splitext(index_page)[0] + '.json'
         self.data_directory = data_directory
         self.file_info = []
         self.urls = []
         self.load_index()  # Load index on creation
 
-    def download_files(self):
-        """Download zip files by distributing work on all available CPUs"""
+    def download_files(self, workers=8):
+        """Download missing zip files on a pool of threads.
+
+        Downloads are I/O bound, so threads are all we need. Interrupted
+        downloads are resumed on the next call, see download_file.
+
+        On KeyboardInterrupt, downloads that haven't started are cancelled
+        and running ones stop after their current chunk, keeping their
+        .part files so that the next call resumes them.
+        """
         if not os.path.isdir(self.data_directory):
             os.makedirs(self.data_directory)
 
@@ -54,19 +143,31 @@ class KGSIndex:
             file_name = file_info['filename']
             if not os.path.isfile(self.data_directory + '/' + file_name):
                 urls_to_download.append((url, self.data_directory + '/' + file_name))
-        cores = multiprocessing.cpu_count()
-        pool = multiprocessing.Pool(processes=cores)
+        if not urls_to_download:
+            return
+
+        progress = DownloadProgress(len(urls_to_download))
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = dict((executor.submit(download_file, url, target_path, progress, stop=stop), url)
+                       for url, target_path in urls_to_download)
+        failed = []
         try:
-            it = pool.imap(worker, urls_to_download)
-            for _ in it:
-                pass
-            pool.close()
-            pool.join()
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except (IOError, OSError) as e:
+                    print('>>> Download of %s failed: %s' % (futures[future], e))
+                    failed.append(futures[future])
         except KeyboardInterrupt:
-            print(">>> Caught KeyboardInterrupt, terminating workers")
-            pool.terminate()
-            pool.join()
+            print(">>> Caught KeyboardInterrupt, cancelling downloads")
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
             sys.exit(-1)
+        executor.shutdown()
+        if failed:
+            raise IOError('%d of %d downloads failed, run again to resume them' % (
+                len(failed), len(urls_to_download)))
 
     def create_index_page(self):
         """If there is no local html containing links to files, create one."""
@@ -87,7 +188,13 @@ class KGSIndex:
         return index_contents
 
     def load_index(self):
-        """Create the actual index representation from the previously downloaded or cached html."""
+        """Create the actual index representation from the cached index, or else from the downloaded or cached html."""
+        if os.path.isfile(self.index_cache) and not (
+                os.path.isfile(self.index_page) and
+                os.path.getmtime(self.index_page) > os.path.getmtime(self.index_cache)):
+            self.file_info = load_json(self.index_cache)
+            self.urls = [file_info['url'] for file_info in self.file_info]
+            return
         index_contents = self.create_index_page()
         split_page = [item for item in index_contents.split('<a href="') if item.startswith("https://")]
         for item in split_page:
@@ -98,8 +205,9 @@ class KGSIndex:
             filename = os.path.basename(url)
             split_file_name = filename.split('-')
             num_games = int(split_file_name[len(split_file_name) - 2])
-            print(filename + ' ' + str(num_games))
-            self.file_info.append({'url': url, 'filename': filename, 'num_games': num_games})
+            year = int(split_file_name[1].split('_')[0])
+            self.file_info.append({'url': url, 'filename': filename, 'year': year, 'num_games': num_games})
+        save_json(self.index_cache, self.file_info)
 
 
 if __name__ == '__main__':
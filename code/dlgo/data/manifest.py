@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import json
+import os
+
+__all__ = [
+    'build_manifest',
+    'chunk_features',
+    'feature_shape',
+    'load_json',
+    'load_manifest',
+    'manifest_path',
+    'save_json',
+]
+
+
+def save_json(path, content):
+    """Write JSON to path atomically: readers see the old file or the complete new one."""
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(content, f)
+    os.replace(tmp_path, path)
+
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def manifest_path(data_dir, data_type):
+    return os.path.join(data_dir, '%s_manifest.json' % data_type)
+
+
+def build_manifest(data_dir, data_type, encoder, samples, chunks):
+    """Describe a processed split and store it as <data_type>_manifest.json.
+
+    Parameters:
+    -----------
+    data_dir: directory holding the processed data
+    data_type: 'train' or 'test'
+    encoder: the Encoder the chunks were produced with, or a list of
+        Encoders for chunks with extra feature stores
+    samples: list of (archive file name, game index) pairs in this split
+    chunks: chunk entries as returned by ProcessingCache.select()
+
+    The manifest lists every chunk file (relative to data_dir) with the row
+    ranges belonging to this split and their count, together with the
+    encoder name, feature shape, dtypes and source games. Sample counts,
+    steps per epoch and file lists can then be taken from it without
+    touching the chunks themselves.
+
+    With several encoders the top-level encoder entries describe the first
+    one, whose files are the chunks' 'features'. 'encoders' then lists the
+    name, version, feature shape and dtype of each, and the chunks hold
+    the files of the others under 'extra_features', keyed by name.
+    """
+    encoders = encoder if isinstance(encoder, (list, tuple)) else [encoder]
+    encoder = encoders[0]
+    manifest = {
+        'data_type': data_type,
+        'encoder': encoder.name(),
+        'encoder_version': encoder.version(),
+        'feature_shape': list(encoder.shape()),
+        'feature_dtype': encoder.dtype(),
+        'label_dtype': 'int16',
+        'num_samples': sum(chunk['rows'] for chunk in chunks),
+        'games': sorted([file_name, index] for file_name, index in samples),
+        'chunks': chunks,
+    }
+    if len(encoders) > 1:
+        manifest['encoders'] = [{
+            'name': e.name(),
+            'version': e.version(),
+            'feature_shape': list(e.shape()),
+            'feature_dtype': e.dtype(),
+        } for e in encoders]
+    save_json(manifest_path(data_dir, data_type), manifest)
+    return manifest
+
+
+def load_manifest(data_dir, data_type):
+    return load_json(manifest_path(data_dir, data_type))
+
+
+def feature_shape(manifest, encoder=None):
+    """Return the feature shape of the named encoder, by default the first one."""
+    if encoder is None or encoder == manifest['encoder']:
+        return tuple(manifest['feature_shape'])
+    for entry in manifest.get('encoders', []):
+        if entry['name'] == encoder:
+            return tuple(entry['feature_shape'])
+    raise KeyError('%s: no features for encoder %s' % (manifest['data_type'], encoder))
+
+
+def chunk_features(manifest, chunk, encoder=None):
+    """Return the feature file of a chunk for the named encoder, by default the first one."""
+    if encoder is None or encoder == manifest['encoder']:
+        return chunk['features']
+    try:
+        return chunk['extra_features'][encoder]
+    except KeyError:
+        raise KeyError('%s: no features for encoder %s' % (manifest['data_type'], encoder))
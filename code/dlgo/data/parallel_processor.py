@@ -2,39 +2,98 @@
 
 from __future__ import print_function
 from __future__ import absolute_import
-import os
-import glob
-import os.path
-import tarfile
-import gzip
-import shutil
-import numpy as np
 import multiprocessing
-from os import sys
-from keras.utils import to_categorical
+import sys
+
+import numpy as np
 
-from dlgo.gosgf import Sgf_game
+from dlgo.gosgf import read_main_line
 from dlgo.goboard_fast import Board, GameState, Move
 from dlgo.gotypes import Player, Point
+from dlgo.data.archive import ArchiveIndex, iter_archive_games
+from dlgo.data.cache import ProcessingCache
+from dlgo.data.chunks import ChunkWriter, consolidate_chunks
 from dlgo.data.index_processor import KGSIndex
+from dlgo.data.manifest import build_manifest, chunk_features, load_manifest
 from dlgo.data.sampling import Sampler
 from dlgo.data.generator import DataGenerator
 from dlgo.encoders.base import get_encoder_by_name
+from dlgo.encoders.incremental import IncrementalEncoding
+
+
+_processor = None
+
+
+def init_worker(clazz, encoder, data_dir):
+    # Each worker process builds its processor once and keeps it for all tasks.
+    global _processor
+    _processor = clazz(encoder=encoder, data_directory=data_dir, processes=1)
+
+
+def index_worker(archive_path):
+    try:
+        ArchiveIndex(archive_path).close()
+        return archive_path
+    except (KeyboardInterrupt, SystemExit):
+        raise Exception('>>> Exiting child process.')
 
 
 def worker(jobinfo):
     try:
-        clazz, encoder, zip_file, data_file_name, game_list = jobinfo
-        clazz(encoder=encoder).process_zip(zip_file, data_file_name, game_list)
+        zip_file, game_list = jobinfo
+        return _processor.process_zip(zip_file, game_list)
     except (KeyboardInterrupt, SystemExit):
         raise Exception('>>> Exiting child process.')
 
 
 class GoDataProcessor:
-    def __init__(self, encoder='simple', data_directory='data'):
+    """Encode KGS games into training data using a pool of worker processes.
+
+    Work is scheduled in batches of games_per_task games rather than one
+    task per archive, so archives with many sampled games don't leave most
+    workers idle. Every batch is stored as its own shard in the processing
+    cache and the shards of an archive are merged when the manifest is
+    written. The pool is started on first use and reused by later
+    load_go_data calls; call close() or use the processor as a context
+    manager to shut it down.
+
+    encoder may be a list of encoder names. Every game is then parsed and
+    replayed once, the positions are encoded with all of them, and each
+    encoder gets its own feature store next to one shared label store.
+    load_go_data returns the features, or generators, as a dict keyed by
+    encoder name.
+    """
+    def __init__(self, encoder='simple', data_directory='data', processes=None,
+                 games_per_task=16):
         self.encoder_string = encoder
-        self.encoder = get_encoder_by_name(encoder, 19)
+        self.multiple_encoders = not isinstance(encoder, str)
+        self.encoder_names = list(encoder) if self.multiple_encoders else [encoder]
+        self.encoders = [get_encoder_by_name(name, 19) for name in self.encoder_names]
+        self.encoder = self.encoders[0]
         self.data_dir = data_directory
+        self.cache = ProcessingCache(data_directory, self.encoders)
+        self.processes = processes or multiprocessing.cpu_count()
+        self.games_per_task = games_per_task
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(
+                processes=self.processes, initializer=init_worker,
+                initargs=(self.__class__, self.encoder_string, self.data_dir))
+        return self._pool
 
 # tag::load_generator[]
     def load_go_data(self, data_type='train', num_samples=1000,
@@ -42,13 +101,18 @@ class GoDataProcessor:
         index = KGSIndex(data_directory=self.data_dir)
         index.download_files()
 
-        sampler = Sampler(data_dir=self.data_dir)
+        sampler = Sampler(data_dir=self.data_dir, index=index)
         data = sampler.draw_data(data_type, num_samples)
 
         # ワークロードをCPUにマップする
         self.map_to_workers(data_type, data)  # <1>
+        manifest = self.write_manifest(data_type, data)
         if use_generator:
-            generator = DataGenerator(self.data_dir, data)
+            if self.multiple_encoders:
+                return dict((name, DataGenerator(self.data_dir, data, data_type, manifest=manifest,
+                                                 encoder=name))
+                            for name in self.encoder_names)
+            generator = DataGenerator(self.data_dir, data, data_type, manifest=manifest)
 
             # 囲碁データジェネレータを返すか
             return generator  # <2>
@@ -63,99 +127,98 @@ class GoDataProcessor:
 # <3> ... or return consolidated data as before.
 # end::load_generator[]
 
-    def unzip_data(self, zip_file_name):
-        this_gz = gzip.open(self.data_dir + '/' + zip_file_name)
-
-        tar_file = zip_file_name[0:-3]
-        this_tar = open(self.data_dir + '/' + tar_file, 'wb')
-
-        shutil.copyfileobj(this_gz, this_tar)
-        this_tar.close()
-        return tar_file
-
-    def process_zip(self, zip_file_name, data_file_name, game_list):
-        tar_file = self.unzip_data(zip_file_name)
-        zip_file = tarfile.open(self.data_dir + '/' + tar_file)
-        name_list = zip_file.getnames()
-        total_examples = self.num_total_examples(zip_file, game_list, name_list)
-
-        shape = self.encoder.shape()
-        feature_shape = np.insert(shape, 0, np.asarray([total_examples]))
-        features = np.zeros(feature_shape)
-        labels = np.zeros((total_examples,))
-
-        counter = 0
-        for index in game_list:
-            name = name_list[index + 1]
-            if not name.endswith('.sgf'):
-                raise ValueError(name + ' is not a valid sgf')
-            sgf_content = zip_file.extractfile(name).read()
-            sgf = Sgf_game.from_string(sgf_content)
-
-            game_state, first_move_done = self.get_handicap(sgf)
-
-            for item in sgf.main_sequence_iter():
-                color, move_tuple = item.get_move()
-                point = None
-                if color is not None:
-                    if move_tuple is not None:
-                        row, col = move_tuple
-                        point = Point(row + 1, col + 1)
-                        move = Move.play(point)
+    def write_manifest(self, data_type, samples):
+        indices_by_zip_name = {}
+        for filename, index in samples:
+            indices_by_zip_name.setdefault(filename, []).append(index)
+        chunks = []
+        for zip_name in sorted(indices_by_zip_name):
+            chunks.extend(self.cache.select(zip_name, indices_by_zip_name[zip_name]))
+        return build_manifest(self.data_dir, data_type, self.encoders, samples, chunks)
+
+    def process_zip(self, zip_file_name, game_list):
+        key = self.cache.shard_key(zip_file_name, game_list)
+        writer = ChunkWriter(self.cache.shard_base(zip_file_name, key),
+                             self.encoder.shape(), self.encoder.dtype(),
+                             extra_features=[(encoder.name(), encoder.shape(), encoder.dtype())
+                                             for encoder in self.encoders[1:]])
+        rows_by_game = {}
+        failed = {}
+
+        games = iter_archive_games(self.data_dir + '/' + zip_file_name, game_list)
+        for index, name, sgf_content in games:
+            try:
+                features, labels = self.encode_game(name, sgf_content)
+            except Exception as e:  # Quarantine the game, keep going with the rest
+                failed[index] = '%s: %s' % (type(e).__name__, e)
+                self.cache.quarantine(zip_file_name, index, name, failed[index])
+                continue
+            first_row = writer.num_rows
+            writer.write_many(features[0], labels, *features[1:])
+            rows_by_game[index] = [first_row, writer.num_rows]
+        chunks = writer.close()
+        return self.cache.record_shard(zip_file_name, key, rows_by_game, chunks, failed)
+
+    def encode_game(self, name, sgf_content):
+        if not name.endswith('.sgf'):
+            raise ValueError(name + ' is not a valid sgf')
+        game = read_main_line(sgf_content)
+
+        game_state, first_move_done = self.get_handicap(game)
+        features = [np.zeros((len(game),) + tuple(encoder.shape()), dtype=encoder.dtype())
+                    for encoder in self.encoders]
+        labels = np.zeros((len(game),), dtype=np.int16)
+        num_examples = 0
+        encoding = None
+        if all(encoder.is_incremental() for encoder in self.encoders):
+            encoding = IncrementalEncoding(self.encoders, game_state.board, game_state.next_player)
+        for color, move_tuple in game.get_moves():
+            point = None
+            if move_tuple is not None:
+                row, col = move_tuple
+                point = Point(row + 1, col + 1)
+                move = Move.play(point)
+            else:
+                move = Move.pass_turn()
+            if first_move_done and point is not None:
+                for i, encoder in enumerate(self.encoders):
+                    if encoding is not None:
+                        encoding.encode_into(features[i][num_examples], i)
                     else:
-                        move = Move.pass_turn()
-                    if first_move_done and point is not None:
-                        features[counter] = self.encoder.encode(game_state)
-                        labels[counter] = self.encoder.encode_point(point)
-                        counter += 1
-                    game_state = game_state.apply_move(move)
-                    first_move_done = True
-
-        feature_file_base = self.data_dir + '/' + data_file_name + '_features_%d'
-        label_file_base = self.data_dir + '/' + data_file_name + '_labels_%d'
-
-        chunk = 0  # Due to files with large content, split up after chunksize
-        chunksize = 1024
-        while features.shape[0] >= chunksize:
-            feature_file = feature_file_base % chunk
-            label_file = label_file_base % chunk
-            chunk += 1
-            current_features, features = features[:chunksize], features[chunksize:]
-            current_labels, labels = labels[:chunksize], labels[chunksize:]
-            np.save(feature_file, current_features)
-            np.save(label_file, current_labels)
+                        encoder.encode_into(game_state, features[i][num_examples])
+                labels[num_examples] = self.encoder.encode_point(point)
+                num_examples += 1
+            if encoding is not None:
+                encoding.apply_move(move)
+            else:
+                game_state = game_state.apply_move(move)
+            first_move_done = True
+        return [encoder_features[:num_examples] for encoder_features in features], labels[:num_examples]
 
     def consolidate_games(self, name, samples):
         files_needed = set(file_name for file_name, index in samples)
-        file_names = []
-        for zip_file_name in files_needed:
-            file_name = zip_file_name.replace('.tar.gz', '') + name
-            file_names.append(file_name)
-
-        feature_list = []
-        label_list = []
-        for file_name in file_names:
-            file_prefix = file_name.replace('.tar.gz', '')
-            base = self.data_dir + '/' + file_prefix + '_features_*.npy'
-            for feature_file in glob.glob(base):
-                label_file = feature_file.replace('features', 'labels')
-                x = np.load(feature_file)
-                y = np.load(label_file)
-                x = x.astype('float32')
-                y = to_categorical(y.astype(int), 19 * 19)
-                feature_list.append(x)
-                label_list.append(y)
-
-        features = np.concatenate(feature_list, axis=0)
-        labels = np.concatenate(label_list, axis=0)
-
-        feature_file = self.data_dir + '/' + name
-        label_file = self.data_dir + '/' + name
-
-        np.save(feature_file, features)
-        np.save(label_file, labels)
-
-        return features, labels
+        manifest = load_manifest(self.data_dir, name)
+        chunks = [chunk for chunk in manifest['chunks'] if chunk['archive'] in files_needed]
+
+        features = {}
+        labels = None
+        for encoder_name in self.encoder_names:
+            chunk_files = [(self.data_dir + '/' + chunk_features(manifest, chunk, encoder_name),
+                            self.data_dir + '/' + chunk['labels'], chunk['ranges'])
+                           for chunk in chunks]
+            if self.multiple_encoders:
+                feature_file = '{}/features_{}_{}.npy'.format(self.data_dir, name, encoder_name)
+            else:
+                feature_file = '{}/features_{}.npy'.format(self.data_dir, name)
+            # Labels are the same for all encoders, written once with the first
+            label_file = None if labels is not None else '{}/labels_{}.npy'.format(self.data_dir, name)
+            features[encoder_name], encoder_labels = consolidate_chunks(chunk_files, feature_file, label_file)
+            if labels is None:
+                labels = encoder_labels
+
+        if self.multiple_encoders:
+            return features, labels
+        return features[self.encoder_names[0]], labels
 
     @staticmethod
     def get_handicap(sgf):  # Get handicap stones
@@ -164,10 +227,12 @@ class GoDataProcessor:
         move = None
         game_state = GameState.new_game(19)
         if sgf.get_handicap() is not None and sgf.get_handicap() != 0:
-            for setup in sgf.get_root().get_setup_stones():
-                for move in setup:
+            # AB stones are black and AW stones white; AE has nothing to clear on an empty board
+            black_stones, white_stones, empty_points = sgf.get_setup_stones()
+            for player, stones in ((Player.black, black_stones), (Player.white, white_stones)):
+                for move in sorted(stones):
                     row, col = move
-                    go_board.place_stone(Player.black, Point(row + 1, col + 1))  # black gets handicap
+                    go_board.place_stone(player, Point(row + 1, col + 1))
             first_move_done = True
             game_state = GameState(go_board, Player.white, None, move)
         return game_state, first_move_done
@@ -181,41 +246,26 @@ class GoDataProcessor:
                 indices_by_zip_name[filename] = []
             indices_by_zip_name[filename].append(index)
 
-        zips_to_process = []
-        for zip_name in zip_names:
-            base_name = zip_name.replace('.tar.gz', '')
-            data_file_name = base_name + data_type
-            if not os.path.isfile(self.data_dir + '/' + data_file_name):
-                zips_to_process.append((self.__class__, self.encoder_string, zip_name,
-                                        data_file_name, indices_by_zip_name[zip_name]))
-
-        cores = multiprocessing.cpu_count()  # Determine number of CPU cores and split work load among them
-        pool = multiprocessing.Pool(processes=cores)
-        p = pool.map_async(worker, zips_to_process)
+        tasks = []
+        for zip_name in sorted(zip_names):
+            missing = self.cache.missing_games(zip_name, indices_by_zip_name[zip_name])
+            for start in range(0, len(missing), self.games_per_task):
+                tasks.append((zip_name, missing[start:start + self.games_per_task]))
+        if not tasks:
+            return
+
+        pool = self._get_pool()
         try:
-            _ = p.get()
+            # Build missing archive indices first, one archive per task, so that
+            # batches of the same archive don't all try to build it at once.
+            archive_paths = sorted(set(self.data_dir + '/' + zip_name for zip_name, games in tasks))
+            for _ in pool.imap_unordered(index_worker, archive_paths):
+                pass
+            chunksize = max(1, len(tasks) // (4 * self.processes))
+            for _ in pool.imap_unordered(worker, tasks, chunksize):
+                pass
         except KeyboardInterrupt:  # Caught keyboard interrupt, terminating workers
             pool.terminate()
             pool.join()
+            self._pool = None
             sys.exit(-1)
-
-    def num_total_examples(self, zip_file, game_list, name_list):
-        total_examples = 0
-        for index in game_list:
-            name = name_list[index + 1]
-            if name.endswith('.sgf'):
-                sgf_content = zip_file.extractfile(name).read()
-                sgf = Sgf_game.from_string(sgf_content)
-                game_state, first_move_done = self.get_handicap(sgf)
-
-                num_moves = 0
-                for item in sgf.main_sequence_iter():
-                    color, move = item.get_move()
-                    if color is not None:
-                        if first_move_done:
-                            num_moves += 1
-                        first_move_done = True
-                total_examples = total_examples + num_moves
-            else:
-                raise ValueError(name + ' is not a valid sgf')
-        return total_examples
@@ -3,23 +3,21 @@
 from __future__ import absolute_import
 
 # tag::base_imports[]
-import os.path
-import tarfile
-import gzip
-import glob
-import shutil
-
 import numpy as np
-from keras.utils import to_categorical
 # end::base_imports[]
 
 # tag::dlgo_imports[]
-from dlgo.gosgf import Sgf_game
+from dlgo.gosgf import read_main_line
 from dlgo.goboard_fast import Board, GameState, Move
 from dlgo.gotypes import Player, Point
 from dlgo.encoders.base import get_encoder_by_name
+from dlgo.encoders.incremental import IncrementalEncoding
 
+from dlgo.data.archive import iter_archive_games
+from dlgo.data.cache import ProcessingCache
+from dlgo.data.chunks import ChunkWriter, consolidate_chunks
 from dlgo.data.index_processor import KGSIndex
+from dlgo.data.manifest import build_manifest, chunk_features, load_manifest
 
 # データ処理のためにdlgoモジュールからインポート
 from dlgo.data.sampling import Sampler  # <1>
@@ -30,8 +28,13 @@ from dlgo.data.sampling import Sampler  # <1>
 # tag::processor_init[]
 class GoDataProcessor:
     def __init__(self, encoder='oneplane', data_directory='data'):
-        self.encoder = get_encoder_by_name(encoder, 19)
+        # エンコーダ名のリストを渡すと、一度の再生ですべてのエンコーダの特徴量を作る
+        self.multiple_encoders = not isinstance(encoder, str)
+        self.encoder_names = list(encoder) if self.multiple_encoders else [encoder]
+        self.encoders = [get_encoder_by_name(name, 19) for name in self.encoder_names]
+        self.encoder = self.encoders[0]
         self.data_dir = data_directory
+        self.cache = ProcessingCache(data_directory, self.encoders)
 # end::processor_init[]
 
 # tag::load_go_data[]
@@ -45,7 +48,7 @@ class GoDataProcessor:
         # データがすでに利用可能な場合は、再度ダウンロードされない。
         index.download_files()  # <3>
 
-        sampler = Sampler(data_dir=self.data_dir)
+        sampler = Sampler(data_dir=self.data_dir, index=index)
 
         # Sampleインスタンスは、選択されたデータ種別のために指定された数のゲームを選択する
         data = sampler.draw_data(data_type, num_samples)  # <4>
@@ -60,16 +63,19 @@ class GoDataProcessor:
 
             # 全てのSGFファイルのインデックスをzipファイル名でグループ化する
             indices_by_zip_name[filename].append(index)  # <6>
-        for zip_name in zip_names:
-            base_name = zip_name.replace('.tar.gz', '')
-            data_file_name = base_name + data_type
-            if not os.path.isfile(self.data_dir + '/' + data_file_name):
+        for zip_name in sorted(zip_names):
+            # 同じエンコーダでまだ処理されていないゲームだけを取り出す
+            missing = self.cache.missing_games(zip_name, indices_by_zip_name[zip_name])
+            if missing:
 
                 # zipファイルは個別に処理される
-                self.process_zip(zip_name, data_file_name, indices_by_zip_name[zip_name])  # <7>
+                self.process_zip(zip_name, missing)  # <7>
+
+        # チャンクファイルと行数の一覧をマニフェストとして書き出す
+        self.write_manifest(data_type, data)  # <8>
 
         # 各zipの特徴量とラベルが結合され、返される
-        features_and_labels = self.consolidate_games(data_type, data)  # <8>
+        features_and_labels = self.consolidate_games(data_type, data)  # <9>
         return features_and_labels
 
 # <1> As `data_type` you can choose either 'train' or 'test'.
@@ -78,148 +84,148 @@ class GoDataProcessor:
 # <4> The `Sampler` instance selects the specified number of games for a data type.
 # <5> We collect all zip file names contained in the data in a list.
 # <6> Then we group all SGF file indices by zip file name.
-# <7> The zip files are then processed individually.
-# <8> Features and labels from each zip are then aggregated and returned.
+# <7> The zip files are then processed individually, encoding only games no earlier run has processed with this encoder.
+# <8> A manifest lists the chunk files and row counts of this data type.
+# <9> Features and labels from each zip are then aggregated and returned.
 # end::load_go_data[]
 
-# tag::unzip_data[]
-    def unzip_data(self, zip_file_name):
-        this_gz = gzip.open(self.data_dir + '/' + zip_file_name)  # <1>
-
-        tar_file = zip_file_name[0:-3]  # <2>
-        this_tar = open(self.data_dir + '/' + tar_file, 'wb')
-
-        shutil.copyfileobj(this_gz, this_tar)  # <3>
-        this_tar.close()
-        return tar_file
-
-# <1> Unpack the `gz` file into a `tar` file.
-# <2> Remove ".gz" at the end to get the name of the tar file.
-# <3> Copy the contents of the unpacked file into the `tar` file.
-# end::unzip_data[]
+    def write_manifest(self, data_type, samples):
+        """Look up the processed rows of all samples and store them as the manifest of data_type."""
+        indices_by_zip_name = {}
+        for filename, index in samples:
+            indices_by_zip_name.setdefault(filename, []).append(index)
+        chunks = []
+        for zip_name in sorted(indices_by_zip_name):
+            chunks.extend(self.cache.select(zip_name, indices_by_zip_name[zip_name]))
+        return build_manifest(self.data_dir, data_type, self.encoders, samples, chunks)
 
 # tag::read_sgf_files[]
-    def process_zip(self, zip_file_name, data_file_name, game_list):
-        tar_file = self.unzip_data(zip_file_name)
-        zip_file = tarfile.open(self.data_dir + '/' + tar_file)
-        name_list = zip_file.getnames()
-
-        # このzipファイル内の全てのゲームの合計着手回数を決定する
-        total_examples = self.num_total_examples(zip_file, game_list, name_list)  # <1>
-
-        # 使用するエンコーダからのフィーちゃとラベルの形状を推測する
-        shape = self.encoder.shape()  # <2>
-        feature_shape = np.insert(shape, 0, np.asarray([total_examples]))
-        features = np.zeros(feature_shape)
-        labels = np.zeros((total_examples,))
-
-        counter = 0
-        for index in game_list:
-            name = name_list[index + 1]
-            if not name.endswith('.sgf'):
-                raise ValueError(name + ' is not a valid sgf')
-            sgf_content = zip_file.extractfile(name).read()
-            # zipファイルを解凍した後、SGFの内容を文字列として読み込む
-            sgf = Sgf_game.from_string(sgf_content)  # <3>
-
-            # すべての置石を適用して、初期のゲーム状態を推測する
-            game_state, first_move_done = self.get_handicap(sgf)  # <4>
-
-            # SGFファイル内のすべての着手を繰り返す
-            for item in sgf.main_sequence_iter():  # <5>
-                color, move_tuple = item.get_move()
-                point = None
-                if color is not None:
-                    # 着手する石の座標を読み込み
-                    if move_tuple is not None:  # <6>
-                        row, col = move_tuple
-                        point = Point(row + 1, col + 1)
-                        move = Move.play(point)
+    def process_zip(self, zip_file_name, game_list):
+        # 合計着手回数を事前に数えずに、各ゲームを一度だけ再生してチャンク単位で書き込む
+        key = self.cache.shard_key(zip_file_name, game_list)
+        writer = ChunkWriter(self.cache.shard_base(zip_file_name, key),  # <1>
+                             self.encoder.shape(), self.encoder.dtype(),
+                             extra_features=[(encoder.name(), encoder.shape(), encoder.dtype())
+                                             for encoder in self.encoders[1:]])
+        rows_by_game = {}
+        failed = {}
+
+        # 圧縮されたアーカイブから、選択されたゲームのSGFだけを取り出す
+        games = iter_archive_games(self.data_dir + '/' + zip_file_name, game_list)
+        for index, name, sgf_content in games:
+            try:
+                features, labels = self.encode_game(name, sgf_content)  # <2>
+            except Exception as e:
+                # 壊れたゲームは理由とともに隔離し、残りのゲームの処理を続ける
+                failed[index] = '%s: %s' % (type(e).__name__, e)  # <3>
+                self.cache.quarantine(zip_file_name, index, name, failed[index])
+                continue
+            first_row = writer.num_rows
+            writer.write_many(features[0], labels, *features[1:])
+            rows_by_game[index] = [first_row, writer.num_rows]
+
+        # 特徴量とラベルは1024のサイズのチャンクとしてローカルに保持される
+        chunks = writer.close()  # <4>
+
+        # 各ゲームの行の範囲を記録し、処理の完了をアトミックに書き込む
+        return self.cache.record_shard(zip_file_name, key, rows_by_game, chunks, failed)  # <5>
+
+    def encode_game(self, name, sgf_content):
+        if not name.endswith('.sgf'):
+            raise ValueError(name + ' is not a valid sgf')
+        # ゲームツリーを構築せずに、SGFのメインラインだけを読み込む
+        game = read_main_line(sgf_content)  # <6>
+
+        # すべての置石を適用して、初期のゲーム状態を推測する
+        game_state, first_move_done = self.get_handicap(game)  # <7>
+
+        # 一局分の特徴量(エンコーダごと)とラベルの配列を、エンコーダの型で一度だけ確保する
+        features = [np.zeros((len(game),) + tuple(encoder.shape()), dtype=encoder.dtype())
+                    for encoder in self.encoders]
+        labels = np.zeros((len(game),), dtype=np.int16)
+        num_examples = 0
+
+        # 差分エンコードに対応するエンコーダでは、一枚の盤の上で対局を再生し、変化した点だけをエンコードし直す
+        encoding = None
+        if all(encoder.is_incremental() for encoder in self.encoders):
+            encoding = IncrementalEncoding(self.encoders, game_state.board, game_state.next_player)  # <8>
+
+        # メインラインのすべての着手を繰り返す
+        for color, move_tuple in game.get_moves():  # <9>
+            point = None
+            # 着手する石の座標を読み込み
+            if move_tuple is not None:  # <10>
+                row, col = move_tuple
+                point = Point(row + 1, col + 1)
+                move = Move.play(point)
+            else:
+                # ない場合はパス
+                move = Move.pass_turn()  # <11>
+            if first_move_done and point is not None:
+                # 現在のゲームの状態を特徴量として、次の着手をラベルとしてエンコードする
+                for i, encoder in enumerate(self.encoders):
+                    if encoding is not None:
+                        encoding.encode_into(features[i][num_examples], i)  # <12>
                     else:
-                        # ない場合はパス
-                        move = Move.pass_turn()  # <7>
-                    if first_move_done and point is not None:
-                        # 現在のゲームの状態を特徴量としてエンコード
-                        features[counter] = self.encoder.encode(game_state)  # <8>
-
-                        # 次の着手を特徴量に対するラベルとしてエンコードする
-                        labels[counter] = self.encoder.encode_point(point)  # <9>
-                        counter += 1
-                    # その後、着手を盤に適用し、次に進む
-                    game_state = game_state.apply_move(move)  # <10>
-                    first_move_done = True
-# <1> Determine the total number of moves in all games in this zip file.
-# <2> Infer the shape of features and labels from the encoder we use.
-# <3> Read the SGF content as string, after extracting the zip file.
-# <4> Infer the initial game state by applying all handicap stones.
-# <5> Iterate over all moves in the SGF file.
-# <6> Read the coordinates of the stone to be played...
-# <7> ... or pass, if there is none.
-# <8> We encode the current game state as features...
-# <9> ... and the next move as label for the features.
-# <10> Afterwards the move is applied to the board and we proceed with the next one.
+                        encoder.encode_into(game_state, features[i][num_examples])
+                labels[num_examples] = self.encoder.encode_point(point)
+                num_examples += 1
+            # その後、着手を盤に適用し、次に進む
+            if encoding is not None:
+                encoding.apply_move(move)  # <13>
+            else:
+                game_state = game_state.apply_move(move)
+            first_move_done = True
+        return [encoder_features[:num_examples] for encoder_features in features], labels[:num_examples]
+# <1> Features and labels are written chunk by chunk while games are replayed, so no counting pass is needed. They are stored in the encoder's compact dtype, with one feature store per encoder sharing the labels.
+# <2> Each game is encoded on its own, for all encoders at once, and only written once it has been replayed completely.
+# <3> A game that fails to parse or replay is quarantined with the reason and the rest of the archive carries on.
+# <4> Features and labels end up in local chunks of size 1024, each stored in a separate file.
+# <5> The rows of each game, and the games that failed, are recorded and the shard is marked complete in one atomic write.
+# <6> Read the main line of the SGF content, without building the full game tree.
+# <7> Infer the initial game state by applying all handicap stones.
+# <8> Encoders that support it replay the game on a single board, re-encoding only the points a move changed, instead of copying the board and encoding it from scratch for every move. With several encoders they all follow the same replay.
+# <9> Iterate over all moves of the main line.
+# <10> Read the coordinates of the stone to be played...
+# <11> ... or pass, if there is none.
+# <12> We encode the current game state as features, with each encoder, and the next move as label for the features, writing into the rows allocated for the game.
+# <13> Afterwards the move is applied to the board and we proceed with the next one.
 # end::read_sgf_files[]
 
-# tag::store_features_and_labels[]
-        # 特徴量とラベルを小さなチャンクとしてローカルに保持する
-        # 小さなチャンクを格納する理由は、データの配列が非常に高速になり、後でより柔軟な小さなファイルにデータを格納できるため。
-        feature_file_base = self.data_dir + '/' + data_file_name + '_features_%d'
-        label_file_base = self.data_dir + '/' + data_file_name + '_labels_%d'
-
-        chunk = 0  # Due to files with large content, split up after chunksize
-        chunksize = 1024
-
-        # 特徴量とラベルを1024のサイズのチャンクで処理する
-        while features.shape[0] >= chunksize:  # <1>
-            feature_file = feature_file_base % chunk
-            label_file = label_file_base % chunk
-            chunk += 1
-            current_features, features = features[:chunksize], features[chunksize:]
-
-            # 現在のチャンクは特徴量とラベルから切り離されている
-            current_labels, labels = labels[:chunksize], labels[chunksize:]  # <2>
-            np.save(feature_file, current_features)
-
-            # 別々のファイルに保存される
-            np.save(label_file, current_labels)  # <3>
-# <1> We process features and labels in chunks of size 1024.
-# <2> The current chunk is cut off from features and labels...
-# <3> ...  and then stored in a separate file.
-# end::store_features_and_labels[]
-
 # tag::consolidate_games[]
     # 特徴量とラベルの個々のnumpy配列を一つの大きなセットにまとめる
     def consolidate_games(self, data_type, samples):
         files_needed = set(file_name for file_name, index in samples)
-        file_names = []
-        for zip_file_name in files_needed:
-            file_name = zip_file_name.replace('.tar.gz', '') + data_type
-            file_names.append(file_name)
-
-        feature_list = []
-        label_list = []
-        for file_name in file_names:
-            file_prefix = file_name.replace('.tar.gz', '')
-            base = self.data_dir + '/' + file_prefix + '_features_*.npy'
-            for feature_file in glob.glob(base):
-                label_file = feature_file.replace('features', 'labels')
-                x = np.load(feature_file)
-                y = np.load(label_file)
-                x = x.astype('float32')
-                y = to_categorical(y.astype(int), 19 * 19)
-                feature_list.append(x)
-                label_list.append(y)
-        features = np.concatenate(feature_list, axis=0)
-        labels = np.concatenate(label_list, axis=0)
-        np.save('{}/features_{}.npy'.format(self.data_dir, data_type), features)
-        np.save('{}/labels_{}.npy'.format(self.data_dir, data_type), labels)
-
-        return features, labels
+        # 全てのチャンクを読み込んで結合するのではなく、事前に確保したメモリマップファイルに書き込む
+        manifest = load_manifest(self.data_dir, data_type)
+        chunks = [chunk for chunk in manifest['chunks'] if chunk['archive'] in files_needed]
+        features = {}
+        labels = None
+        for name in self.encoder_names:
+            chunk_files = [(self.data_dir + '/' + chunk_features(manifest, chunk, name),
+                            self.data_dir + '/' + chunk['labels'], chunk['ranges'])
+                           for chunk in chunks]
+            if self.multiple_encoders:
+                feature_file = '{}/features_{}_{}.npy'.format(self.data_dir, data_type, name)
+            else:
+                feature_file = '{}/features_{}.npy'.format(self.data_dir, data_type)
+            # ラベルはすべてのエンコーダで共通なので、最初のエンコーダと一緒に一度だけ書き込む
+            label_file = None if labels is not None else '{}/labels_{}.npy'.format(self.data_dir, data_type)
+            features[name], encoder_labels = consolidate_chunks(chunk_files, feature_file, label_file)  # <1>
+            if labels is None:
+                labels = encoder_labels
+
+        # 複数のエンコーダでは、エンコーダ名ごとの特徴量の辞書を返す
+        if self.multiple_encoders:
+            return features, labels  # <2>
+        return features[self.encoder_names[0]], labels
     """
     大量の小さなファイルをメモリに読み込んで結合する手順では、大量のデータをロードするときにメモリ不足の例外(out-of-memory exceptions)
     が発生する可能性がある。
     データジェネレータを使用してモデルの訓練時に必要な次のミニバッチデータを提供することで、この問題を解決する。
     """
+# <1> Chunks are copied into preallocated memory-mapped files. Features keep their compact dtype and labels stay sparse point indices.
+# <2> With several encoders, features_<data_type>_<encoder>.npy is written per encoder, all aligned with the one labels_<data_type>.npy, and returned as a dict keyed by encoder name.
 # end::consolidate_games[]
 
 # tag::get_handicap[]
@@ -231,35 +237,13 @@ class GoDataProcessor:
         move = None
         game_state = GameState.new_game(19)
         if sgf.get_handicap() is not None and sgf.get_handicap() != 0:
-            for setup in sgf.get_root().get_setup_stones():
-                for move in setup:
+            # 黒の置石(AB)は黒、白の置石(AW)は白として置く。空点の指定(AE)は空の盤面では何もしない
+            black_stones, white_stones, empty_points = sgf.get_setup_stones()
+            for player, stones in ((Player.black, black_stones), (Player.white, white_stones)):
+                for move in sorted(stones):
                     row, col = move
-                    go_board.place_stone(Player.black, Point(row + 1, col + 1))
+                    go_board.place_stone(player, Point(row + 1, col + 1))
             first_move_done = True
             game_state = GameState(go_board, Player.white, None, move)
         return game_state, first_move_done
 # end::get_handicap[]
-
-# tag::num_total_examples[]
-    # 現在のzipファイルで使用可能な着手の合計数を計算する
-    def num_total_examples(self, zip_file, game_list, name_list):
-        total_examples = 0
-        for index in game_list:
-            name = name_list[index + 1]
-            if name.endswith('.sgf'):
-                sgf_content = zip_file.extractfile(name).read()
-                sgf = Sgf_game.from_string(sgf_content)
-                game_state, first_move_done = self.get_handicap(sgf)
-
-                num_moves = 0
-                for item in sgf.main_sequence_iter():
-                    color, move = item.get_move()
-                    if color is not None:
-                        if first_move_done:
-                            num_moves += 1
-                        first_move_done = True
-                total_examples = total_examples + num_moves
-            else:
-                raise ValueError(name + ' is not a valid sgf')
-        return total_examples
-# end::num_total_examples[]
@@ -3,24 +3,47 @@
 # obtain one at http://mozilla.org/MPL/2.0/.
 from __future__ import print_function
 from __future__ import absolute_import
+import ast
 import os
-import random
+
+import numpy as np
+
 from dlgo.data.index_processor import KGSIndex
-from six.moves import range
 
 
 class Sampler:
-    """Sample training and test data from zipped sgf files such that test data is kept stable."""
-    def __init__(self, data_dir='data', num_test_games=100, cap_year=2015, seed=1337):
+    """Sample training and test data from zipped sgf files such that test data is kept stable.
+
+    All games of the archives up to cap_year are numbered consecutively, so a
+    game is a single integer id and (filename, index) pairs are only built
+    for the games actually drawn. Test games are excluded from training
+    draws with a boolean mask over that id space.
+
+    The fixed test set is stored in test_samples.npz. An old text file
+    test_samples.py is converted on first use.
+    """
+    def __init__(self, data_dir='data', num_test_games=100, cap_year=2015, seed=1337, index=None):
         self.data_dir = data_dir
+        if index is None:
+            index = KGSIndex(data_directory=data_dir)
+        self.index = index
         self.num_test_games = num_test_games
         self.test_games = []
         self.train_games = []
         self.test_folder = 'test_samples.py'
+        self.test_file = 'test_samples.npz'
         self.cap_year = cap_year
 
-        random.seed(seed)
+        self.rng = np.random.RandomState(seed)
+        self.filenames = [file_info['filename'] for file_info in self.index.file_info
+                          if file_info['year'] <= cap_year and 'num_games' in file_info]
+        num_games = [file_info['num_games'] for file_info in self.index.file_info
+                     if file_info['year'] <= cap_year and 'num_games' in file_info]
+        self.offsets = np.concatenate([[0], np.cumsum(num_games, dtype=np.int64)])
+        self.num_games = int(self.offsets[-1])
         self.compute_test_samples()
+        self.train_mask = np.ones(self.num_games, dtype=bool)
+        self.train_mask[self.game_ids(self.test_games)] = False
 
     def draw_data(self, data_type, num_samples):
         if data_type == 'test':
@@ -32,106 +55,112 @@ class Sampler:
         else:
             raise ValueError(data_type + " is not a valid data type, choose from 'train' or 'test'")
 
+    def games(self, game_ids):
+        """Turn game ids into (filename, index) pairs."""
+        game_ids = np.asarray(game_ids, dtype=np.int64)
+        file_ids = np.searchsorted(self.offsets, game_ids, side='right') - 1
+        indices = game_ids - self.offsets[file_ids]
+        return [(self.filenames[file_id], index)
+                for file_id, index in zip(file_ids.tolist(), indices.tolist())]
+
+    def game_ids(self, games):
+        """Turn (filename, index) pairs into game ids, dropping games outside the sampled archives."""
+        file_ids = dict((filename, file_id) for file_id, filename in enumerate(self.filenames))
+        game_ids = [self.offsets[file_ids[filename]] + index for filename, index in games
+                    if filename in file_ids]
+        return np.array(game_ids, dtype=np.int64)
+
     def draw_samples(self, num_sample_games):
         """Draw num_sample_games many training games from index."""
-        available_games = []
-        index = KGSIndex(data_directory=self.data_dir)
-
-        for fileinfo in index.file_info:
-            filename = fileinfo['filename']
-            year = int(filename.split('-')[1].split('_')[0])
-            if year > self.cap_year:
-                continue
-            num_games = fileinfo['num_games']
-            for i in range(num_games):
-                available_games.append((filename, i))
-        print('>>> Total number of games used: ' + str(len(available_games)))
-
-        sample_set = set()
-        while len(sample_set) < num_sample_games:
-            sample = random.choice(available_games)
-            if sample not in sample_set:
-                sample_set.add(sample)
+        print('>>> Total number of games used: ' + str(self.num_games))
+        game_ids = self.rng.choice(self.num_games, num_sample_games, replace=False)
         print('Drawn ' + str(num_sample_games) + ' samples:')
-        return list(sample_set)
+        return self.games(game_ids)
 
     def draw_training_games(self):
         """Get list of all non-test games, that are no later than dec 2014
         Ignore games after cap_year to keep training data stable
         """
-        index = KGSIndex(data_directory=self.data_dir)
-        for file_info in index.file_info:
-            filename = file_info['filename']
-            year = int(filename.split('-')[1].split('_')[0])
-            if year > self.cap_year:
-                continue
-            num_games = file_info['num_games']
-            for i in range(num_games):
-                sample = (filename, i)
-                if sample not in self.test_games:
-                    self.train_games.append(sample)
+        self.train_games = self.games(np.flatnonzero(self.train_mask))
         print('total num training games: ' + str(len(self.train_games)))
 
     def compute_test_samples(self):
         """If not already existing, create local file to store fixed set of test samples"""
-        if not os.path.isfile(self.test_folder):
-            test_games = self.draw_samples(self.num_test_games)
-            test_sample_file = open(self.test_folder, 'w')
-            for sample in test_games:
-                test_sample_file.write(str(sample) + "\n")
-            test_sample_file.close()
-
-        test_sample_file = open(self.test_folder, 'r')
-        sample_contents = test_sample_file.read()
-        test_sample_file.close()
-        for line in sample_contents.split('\n'):
-            if line != "":
-                (filename, index) = eval(line)
-                self.test_games.append((filename, index))
+        if not os.path.isfile(self.test_file):
+            if os.path.isfile(self.test_folder):
+                test_games = self.read_legacy_test_samples()
+            else:
+                test_games = self.draw_samples(self.num_test_games)
+            filenames = sorted(set(filename for filename, index in test_games))
+            file_ids = dict((filename, file_id) for file_id, filename in enumerate(filenames))
+            np.savez(self.test_file,
+                     filenames=np.array(filenames),
+                     file_ids=np.array([file_ids[filename] for filename, index in test_games],
+                                       dtype=np.int32),
+                     indices=np.array([index for filename, index in test_games], dtype=np.int32))
+
+        with np.load(self.test_file) as test_samples:
+            filenames = test_samples['filenames'].tolist()
+            self.test_games = [(filenames[file_id], index) for file_id, index in
+                               zip(test_samples['file_ids'].tolist(), test_samples['indices'].tolist())]
+
+    def read_legacy_test_samples(self):
+        """Read test samples from the text file earlier versions stored, one tuple per line."""
+        test_games = []
+        with open(self.test_folder, 'r') as test_sample_file:
+            for line in test_sample_file:
+                if line.strip() != "":
+                    (filename, index) = ast.literal_eval(line)
+                    test_games.append((filename, index))
+        return test_games
 
     def draw_training_samples(self, num_sample_games):
         """Draw training games, not overlapping with any of the test games."""
-        available_games = []
-        index = KGSIndex(data_directory=self.data_dir)
-        for fileinfo in index.file_info:
-            filename = fileinfo['filename']
-            year = int(filename.split('-')[1].split('_')[0])
-            if year > self.cap_year:
-                continue
-            num_games = fileinfo['num_games']
-            for i in range(num_games):
-                available_games.append((filename, i))
-        print('total num games: ' + str(len(available_games)))
-
-        sample_set = set()
-        while len(sample_set) < num_sample_games:
-            sample = random.choice(available_games)
-            if sample not in self.test_games:
-                sample_set.add(sample)
+        print('total num games: ' + str(self.num_games))
+        available = np.flatnonzero(self.train_mask)
+        game_ids = self.rng.choice(available, num_sample_games, replace=False)
         print('Drawn ' + str(num_sample_games) + ' samples:')
-        return list(sample_set)
+        return self.games(game_ids)
+
+    def draw_from_catalog(self, catalog, num_sample_games=None, where=None, params=(), stratify_by=None):
+        """Draw training games matching an SQL condition on a GameCatalog, without reading archives.
+
+        Only games of the sampled archives that aren't test games are drawn.
+        With stratify_by, a catalog column such as 'handicap' or 'year', the
+        games are spread as evenly as possible over the values of that
+        column: strata with fewer games are taken completely and the rest
+        is shared among the larger ones. num_sample_games=None draws all
+        matching games.
+        """
+        filenames = set(self.filenames)
+        test_games = set(self.test_games)
+        columns = (stratify_by,) if stratify_by else ()
+        strata = {}
+        for row in catalog.select(where, params, columns):
+            game = row[:2]
+            if game[0] in filenames and game not in test_games:
+                strata.setdefault(row[2:], []).append(game)
+        available = sum(len(games) for games in strata.values())
+        print('total num matching games: ' + str(available))
+        if num_sample_games is None:
+            num_sample_games = available
+        elif num_sample_games > available:
+            raise ValueError('Only %d games match, cannot draw %d' % (available, num_sample_games))
+
+        samples = []
+        remaining = num_sample_games
+        by_size = sorted(strata.items(), key=lambda item: len(item[1]))
+        for i, (stratum, games) in enumerate(by_size):
+            quota = min(len(games), remaining // (len(by_size) - i))
+            picks = self.rng.choice(len(games), quota, replace=False)
+            samples.extend(games[pick] for pick in sorted(picks.tolist()))
+            remaining -= quota
+        print('Drawn ' + str(len(samples)) + ' samples from ' + str(len(strata)) + ' strata:')
+        return samples
 
     def draw_all_training(self):
         """Draw all available training games."""
-        available_games = []
-        index = KGSIndex(data_directory=self.data_dir)
-
-        for fileinfo in index.file_info:
-            filename = fileinfo['filename']
-            year = int(filename.split('-')[1].split('_')[0])
-            if year > self.cap_year:
-                continue
-            if 'num_games' in fileinfo.keys():
-                num_games = fileinfo['num_games']
-            else:
-                continue
-            for i in range(num_games):
-                available_games.append((filename, i))
-        print('total num games: ' + str(len(available_games)))
-
-        sample_set = set()
-        for sample in available_games:
-            if sample not in self.test_games:
-                sample_set.add(sample)
-        print('Drawn all samples, ie ' + str(len(sample_set)) + ' samples:')
-        return list(sample_set)
+        print('total num games: ' + str(self.num_games))
+        samples = self.games(np.flatnonzero(self.train_mask))
+        print('Drawn all samples, ie ' + str(len(samples)) + ' samples:')
+        return samples
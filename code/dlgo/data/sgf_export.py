@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+from dlgo.gotypes import Player
+from dlgo.scoring import compute_game_result
+
+__all__ = [
+    'game_moves',
+    'game_result',
+    'write_game_state',
+]
+
+
+def game_moves(game_state):
+    """Return the moves that led to game_state as (colour, move) pairs for dlgo.gosgf.
+
+    The moves are collected by following previous_state back to the start
+    of the game. Points are converted to the 0-based (row, col) that
+    dlgo.gosgf uses, passes become None and a resignation is left out.
+    """
+    moves = []
+    state = game_state
+    while state.previous_state is not None:
+        move = state.last_move
+        if not move.is_resign:
+            colour = 'b' if state.previous_state.next_player == Player.black else 'w'
+            point = (move.point.row - 1, move.point.col - 1) if move.is_play else None
+            moves.append((colour, point))
+        state = state.previous_state
+    moves.reverse()
+    return moves
+
+
+def game_result(game_state):
+    """Return the SGF result of a finished game, e.g. 'B+R' or 'W+7.5', or None if it isn't over."""
+    if not game_state.is_over():
+        return None
+    if game_state.last_move.is_resign:
+        return '%s+R' % ('B' if game_state.next_player == Player.black else 'W')
+    return str(compute_game_result(game_state))
+
+
+def write_game_state(writer, game_state, komi=7.5):
+    """Append the game leading to game_state to an Sgf_collection_writer."""
+    writer.write_game(game_state.board.num_rows, game_moves(game_state),
+                      komi=komi, result=game_result(game_state))
@@ -4,6 +4,8 @@
 import importlib
 # end::importlib[]
 
+import numpy as np
+
 __all__ = [
     'Encoder',
     'get_encoder_by_name',
@@ -44,6 +46,39 @@ class Encoder:
 # <6> Shape of the encoded board structure.
 # end::base_encoder[]
 
+    # エンコードされた特徴量を保存する際のnumpyの型。-1/0/1のような小さな値しか持たないエンコーダはint8で十分
+    def dtype(self):
+        return 'int8'
+
+    # エンコードの内容を変更した場合はバージョンを上げ、処理済みのデータを作り直す
+    def version(self):
+        return 1
+
+    # 盤面をあらかじめ確保された配列outに書き込む。配列を確保しない実装で上書きすること
+    def encode_into(self, game_state, out):
+        out[...] = self.encode(game_state)
+        return out
+
+    # 複数の盤面を一つの配列にまとめてエンコードする。outがなければエンコーダの型で確保する
+    def encode_batch(self, game_states, out=None):
+        if out is None:
+            out = np.zeros((len(game_states),) + tuple(self.shape()), dtype=self.dtype())
+        for i, game_state in enumerate(game_states):
+            self.encode_into(game_state, out[i])
+        return out
+
+    # 差分エンコード(IncrementalEncoding)に対応するエンコーダは、stone_planesとencode_planesを実装してTrueを返す
+    def is_incremental(self):
+        return False
+
+    # 盤上の点ごとの石の色(黒1, 白-1)と呼吸点の数から、黒から見た石の平面を(平面の数, 点の数)の形で計算する
+    def stone_planes(self, colors, liberties):
+        raise NotImplementedError()
+
+    # IncrementalEncodingが保つこのエンコーダの石の平面(planes)から、次の手番から見た局面をoutに書き込む
+    def encode_planes(self, planes, encoding, out):
+        raise NotImplementedError()
+
 
 # tag::encoder_by_name[]
 def get_encoder_by_name(name, board_size):  # <1>
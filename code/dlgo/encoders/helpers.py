@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from dlgo import zobrist
+from dlgo.gotypes import Player, Point
+
+__all__ = [
+    'has_board_arrays',
+    'ko_points',
+    'stack_boards',
+]
+
+
+def has_board_arrays(game_states):
+    """Whether all boards keep arrays of stone colours and liberty counts, as goboard_fast does."""
+    return all(hasattr(game_state.board, 'liberty_counts') for game_state in game_states)
+
+
+_points_by_size = {}
+
+
+def _points(num_rows, num_cols):
+    """Return the points of a board as a list indexed by (row - 1) * num_cols + (col - 1)."""
+    try:
+        return _points_by_size[num_rows, num_cols]
+    except KeyError:
+        pass
+    points = [Point(row, col) for row in range(1, num_rows + 1) for col in range(1, num_cols + 1)]
+    _points_by_size[num_rows, num_cols] = points
+    return points
+
+
+_zobrist_codes = {}
+
+
+def _zobrist_codes_by_color():
+    """Return zobrist.HASH_CODE as a dict of {point: code} per colour, which is faster to look up."""
+    if not _zobrist_codes:
+        for (point, color), code in zobrist.HASH_CODE.items():
+            _zobrist_codes.setdefault(color, {})[point] = code
+    return _zobrist_codes
+
+
+def ko_points(board, player, previous_states, in_atari=None):
+    """Return the (row - 1, col - 1) indices of the empty points player can't play because of ko.
+
+    previous_states is the set of (next player, Zobrist hash) pairs of the
+    positions before, as in GameState.previous_states.
+
+    Only a move that captures can violate ko, so only the last liberty of
+    opponent strings in atari has to be checked. in_atari, a boolean array
+    marking the opponent stones with one liberty, is computed from the
+    board if not given. The Zobrist hash after each capture is worked out
+    from the captured stones, giving the same answer as
+    GameState.does_move_violate_ko() without copying the board.
+    """
+    if in_atari is None:
+        opponent = -1 if player == Player.black else 1
+        in_atari = (board.liberty_counts() == 1) & (board.stone_colors() == opponent)
+    points = _points(board.num_rows, board.num_cols)
+    captures = {}
+    for index in np.flatnonzero(in_atari).tolist():
+        string = board.get_go_string(points[index])
+        point, = string.liberties
+        captures.setdefault(point, {})[id(string)] = string
+    codes = _zobrist_codes_by_color()
+    empty_codes, player_codes = codes[None], codes[player]
+    ko = []
+    for point, strings in captures.items():
+        next_hash = board.zobrist_hash() ^ empty_codes[point] ^ player_codes[point]
+        for string in strings.values():
+            stone_codes = codes[string.color]
+            for stone in string.stones:
+                next_hash ^= stone_codes[stone] ^ empty_codes[stone]
+        if (player.other, next_hash) in previous_states:
+            ko.append((point.row - 1, point.col - 1))
+    return ko
+
+
+def stack_boards(game_states):
+    """Copy the stone colours and liberty counts of many boards into arrays.
+
+    Returns (colors, liberties, black_to_play), where colors and liberties
+    have one board per row and black_to_play is a boolean array. There must
+    be at least one game state.
+    """
+    board = game_states[0].board
+    shape = (len(game_states), board.num_rows, board.num_cols)
+    colors = np.empty(shape, dtype=np.int8)
+    liberties = np.empty(shape, dtype=np.int16)
+    black_to_play = np.empty(len(game_states), dtype=bool)
+    for i, game_state in enumerate(game_states):
+        colors[i] = game_state.board.stone_colors()
+        liberties[i] = game_state.board.liberty_counts()
+        black_to_play[i] = game_state.next_player == Player.black
+    return colors, liberties, black_to_play
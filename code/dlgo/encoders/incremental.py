@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from dlgo.encoders.base import Encoder
+
+__all__ = [
+    'IncrementalEncoding',
+]
+
+
+class IncrementalEncoding:
+    """Encode the positions of one game while it is replayed on a single board.
+
+    GameState.apply_move() copies the board for every move, and encode()
+    then works through the whole board again. Here moves are played on one
+    goboard_fast Board in place. The encoder's stone planes are kept from
+    black's point of view, and only the points the board reports as changed
+    are recomputed after a move. encode_into() turns them into the next
+    player's point of view, e.g. by flipping signs or swapping the planes
+    of both colours.
+
+    This saves the board copy and the full encoding of every position, but
+    playing the move itself, Board.place_stone(), remains and is now the
+    larger part of the cost: replay and encoding together are only about
+    1.2 to 1.4 times as fast as with apply_move() and encode(), not several
+    times.
+
+    encoders is an Encoder or a list of Encoders. With several, the game is
+    still replayed once and the stone planes of all of them are updated
+    from the same changes; index selects the encoder in encode_into() and
+    encode().
+
+    The encoders must support it, see Encoder.is_incremental(). Players
+    alternate from next_player on, as with GameState.apply_move(), and
+    previous_states is kept the same way for the ko checks.
+
+    Public attributes (treat as read-only):
+      encoders        -- list of the Encoders
+      encoder         -- the first of them
+      board           -- the Board, changed in place
+      next_player     -- Player to move
+      previous_states -- set of (next player, Zobrist hash) of earlier positions
+      planes          -- per encoder, stone planes from black's point of view, one board each
+    """
+    def __init__(self, encoders, board, next_player):
+        if isinstance(encoders, Encoder):
+            encoders = [encoders]
+        self.encoders = list(encoders)
+        self.encoder = self.encoders[0]
+        self.board = board
+        self.next_player = next_player
+        self.previous_states = set()
+        board.pop_changes()
+        self._colors = board.stone_colors().reshape(-1)
+        self._liberties = board.liberty_counts().reshape(-1)
+        self._planes = [np.array(encoder.stone_planes(self._colors, self._liberties))
+                        for encoder in self.encoders]
+        self.planes = [planes.reshape((-1, board.num_rows, board.num_cols))
+                       for planes in self._planes]
+
+    def apply_move(self, move):
+        """Play a move for the next player, updating the planes at the changed points."""
+        self.previous_states.add((self.next_player, self.board.zobrist_hash()))
+        if move.is_play:
+            self.board.place_stone(self.next_player, move.point)
+            changes = self.board.pop_changes()
+            colors = self._colors.take(changes)
+            liberties = self._liberties.take(changes)
+            for encoder, planes in zip(self.encoders, self._planes):
+                planes[:, changes] = encoder.stone_planes(colors, liberties)
+        self.next_player = self.next_player.other
+
+    def encode_into(self, out, index=0):
+        """Write the current position, as encoder index's encode() would, into out and return it."""
+        return self.encoders[index].encode_planes(self.planes[index], self, out)
+
+    def encode(self, index=0):
+        """Return the current position as a new array in the dtype of encoder index."""
+        encoder = self.encoders[index]
+        return self.encode_into(np.zeros(encoder.shape(), dtype=encoder.dtype()), index)
@@ -5,6 +5,7 @@ import numpy as np
 
 from dlgo.encoders.base import Encoder
 from dlgo.goboard import Point
+from dlgo.gotypes import Player
 # end::oneplane_imports[]
 
 
@@ -19,23 +20,30 @@ class OnePlaneEncoder(Encoder):
         return 'oneplane'
 
     # 囲碁の盤面を数値データに変換する
-    def encode(self, game_state):  # <2>
-        board_matrix = np.zeros(self.shape())
-        next_player = game_state.next_player
+    def encode(self, game_state, out=None):  # <2>
+        if out is None:
+            out = np.zeros(self.shape())
+        board = game_state.board
+        sign = 1 if game_state.next_player == Player.black else -1
+        if hasattr(board, 'stone_colors'):
+            np.multiply(board.stone_colors(), sign, out=out[0])  # <3>
+            return out
+        out[0] = 0
         for r in range(self.board_height):
             for c in range(self.board_width):
                 p = Point(row=r + 1, col=c + 1)
-                go_string = game_state.board.get_go_string(p)
+                go_string = board.get_go_string(p)
                 if go_string is None:
                     continue
-                if go_string.color == next_player:
-                    board_matrix[0, r, c] = 1
+                if go_string.color == Player.black:
+                    out[0, r, c] = sign
                 else:
-                    board_matrix[0, r, c] = -1
-        return board_matrix
+                    out[0, r, c] = -sign
+        return out
 
 # <1> We can reference this encoder by the name "oneplane".
-# <2> To encode, we fill a matrix with 1 if the point contains one of the current player's stones, -1 if the point contains the opponent's stones and 0 if the point is empty.
+# <2> To encode, we fill a matrix with 1 if the point contains one of the current player's stones, -1 if the point contains the opponent's stones and 0 if the point is empty. A preallocated array can be passed as out to be filled instead.
+# <3> Boards that keep an array of stone colours (black 1, white -1) are encoded in one operation: the array is multiplied by -1 when white is to play.
 # end::oneplane_encoder[]
 
 # tag::oneplane_encoder_2[]
@@ -61,6 +69,35 @@ class OnePlaneEncoder(Encoder):
 # <2> Turn an integer index into a board point.
 # end::oneplane_encoder_2[]
 
+    # 盤面をあらかじめ確保された配列outに書き込む
+    def encode_into(self, game_state, out):
+        return self.encode(game_state, out=out)
+
+    # 石の色の配列を持つ盤面は、まとめてコピーしてから手番の符号を一度に掛ける
+    def encode_batch(self, game_states, out=None):
+        if out is None:
+            out = np.zeros((len(game_states),) + self.shape(), dtype=self.dtype())
+        if not all(hasattr(game_state.board, 'stone_colors') for game_state in game_states):
+            return Encoder.encode_batch(self, game_states, out)
+        signs = np.empty(len(game_states), dtype=out.dtype)
+        for i, game_state in enumerate(game_states):
+            out[i, 0] = game_state.board.stone_colors()
+            signs[i] = 1 if game_state.next_player == Player.black else -1
+        out[:, 0] *= signs[:, np.newaxis, np.newaxis]
+        return out
+
+    def is_incremental(self):
+        return True
+
+    # 黒から見た平面は石の色そのもの。白の手番では符号を反転する
+    def stone_planes(self, colors, liberties):
+        return colors[np.newaxis]
+
+    def encode_planes(self, planes, encoding, out):
+        sign = 1 if encoding.next_player == Player.black else -1
+        np.multiply(planes[0], sign, out=out[0])
+        return out
+
 
 # tag::oneplane_create[]
 def create(board_size):
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+# tag::sevenplane_imports[]
+import numpy as np
+
+from dlgo.encoders.base import Encoder
+from dlgo.encoders.helpers import has_board_arrays, ko_points, stack_boards
+from dlgo.goboard import Move, Point
+from dlgo.gotypes import Player
+# end::sevenplane_imports[]
+
+__all__ = [
+    'SevenPlaneEncoder',
+]
+
+
+# tag::sevenplane_init[]
+class SevenPlaneEncoder(Encoder):
+    def __init__(self, board_size):
+        self.board_width, self.board_height = board_size
+        self.num_planes = 7
+        # 石のある点のコードは、呼吸点の数(最大3)で、相手の石なら負の数になる。各平面に入るコード
+        self.plane_codes = np.array([1, 2, 3, -1, -2, -3], dtype=np.int16).reshape(6, 1, 1)
+
+    def name(self):
+        return 'sevenplane'
+# end::sevenplane_init[]
+
+# tag::sevenplane_encode[]
+    # 自分の石と相手の石を呼吸点の数(1, 2, 3以上)で6つの平面に分け、7番目の平面にコウで打てない点を置く
+    def encode(self, game_state, out=None):
+        if out is None:
+            out = np.zeros(self.shape())
+        board = game_state.board
+        if not has_board_arrays([game_state]):
+            return self.encode_by_points(game_state, out)  # <1>
+        codes = np.minimum(board.liberty_counts(), 3)  # <2>
+        codes *= board.stone_colors()
+        if game_state.next_player == Player.white:
+            np.negative(codes, out=codes)
+        np.equal(codes, self.plane_codes, out=out[:6])  # <3>
+        out[6] = 0
+        ko = ko_points(board, game_state.next_player, game_state.previous_states, codes == -1)  # <4>
+        for row, col in ko:
+            out[6, row, col] = 1
+        return out
+
+# <1> Boards without arrays of stone colours and liberty counts are encoded point by point.
+# <2> Liberty counts are kept by the board for every stone, so they are read directly instead of being computed for each position.
+# <3> Codes are liberty counts, negative for opponent stones, so a single comparison against the code of each plane fills all six stone planes.
+# <4> Only the liberties of opponent strings in atari can be ko points, so only those are checked.
+# end::sevenplane_encode[]
+
+    def encode_by_points(self, game_state, out):
+        out[...] = 0
+        for r in range(self.board_height):
+            for c in range(self.board_width):
+                p = Point(row=r + 1, col=c + 1)
+                go_string = game_state.board.get_go_string(p)
+                if go_string is None:
+                    if game_state.does_move_violate_ko(game_state.next_player, Move.play(p)):
+                        out[6, r, c] = 1
+                else:
+                    liberty_plane = min(3, go_string.num_liberties) - 1
+                    if go_string.color != game_state.next_player:
+                        liberty_plane += 3
+                    out[liberty_plane, r, c] = 1
+        return out
+
+    def encode_into(self, game_state, out):
+        return self.encode(game_state, out=out)
+
+    # 複数の盤面の配列をまとめてから、一度の比較ですべての石の平面を埋める
+    def encode_batch(self, game_states, out=None):
+        if out is None:
+            out = np.zeros((len(game_states),) + self.shape(), dtype=self.dtype())
+        if not game_states or not has_board_arrays(game_states):
+            return Encoder.encode_batch(self, game_states, out)
+        colors, liberties, black_to_play = stack_boards(game_states)
+        codes = np.minimum(liberties, 3)
+        codes *= colors
+        codes[~black_to_play] *= -1
+        np.equal(codes[:, np.newaxis], self.plane_codes, out=out[:, :6])
+        out[:, 6] = 0
+        for i, game_state in enumerate(game_states):
+            ko = ko_points(game_state.board, game_state.next_player, game_state.previous_states,
+                           codes[i] == -1)
+            for row, col in ko:
+                out[i, 6, row, col] = 1
+        return out
+
+    def is_incremental(self):
+        return True
+
+    # 黒から見た石の平面: 黒石が平面0 - 2、白石が平面3 - 5に入る
+    def stone_planes(self, colors, liberties):
+        codes = np.minimum(liberties, 3)
+        codes *= colors
+        return np.equal(codes, self.plane_codes.reshape(6, 1))
+
+    # 白の手番では、黒石と白石の平面を入れ替える
+    def encode_planes(self, planes, encoding, out):
+        if encoding.next_player == Player.black:
+            out[:6] = planes
+            in_atari = planes[3]
+        else:
+            out[:3] = planes[3:]
+            out[3:6] = planes[:3]
+            in_atari = planes[0]
+        out[6] = 0
+        ko = ko_points(encoding.board, encoding.next_player, encoding.previous_states, in_atari)
+        for row, col in ko:
+            out[6, row, col] = 1
+        return out
+
+    def encode_point(self, point):
+        return self.board_width * (point.row - 1) + (point.col - 1)
+
+    def decode_point_index(self, index):
+        row = index // self.board_width
+        col = index % self.board_width
+        return Point(row=row + 1, col=col + 1)
+
+    def num_points(self):
+        return self.board_width * self.board_height
+
+    def shape(self):
+        return self.num_planes, self.board_height, self.board_width
+
+
+def create(board_size):
+    return SevenPlaneEncoder(board_size)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+# tag::simple_imports[]
+import numpy as np
+
+from dlgo.encoders.base import Encoder
+from dlgo.encoders.helpers import has_board_arrays, ko_points, stack_boards
+from dlgo.goboard import Move, Point
+from dlgo.gotypes import Player
+# end::simple_imports[]
+
+__all__ = [
+    'SimpleEncoder',
+]
+
+
+# tag::simple_init[]
+class SimpleEncoder(Encoder):
+    def __init__(self, board_size):
+        self.board_width, self.board_height = board_size
+        # 0 - 3. 呼吸点が1, 2, 3, 4以上の黒石
+        # 4 - 7. 呼吸点が1, 2, 3, 4以上の白石
+        # 8. 黒の手番なら1
+        # 9. 白の手番なら1
+        # 10. コウで打てない点
+        self.num_planes = 11
+        # 石のある点のコードは、呼吸点の数(最大4)で、白石なら負の数になる。各平面に入るコード
+        self.plane_codes = np.array([1, 2, 3, 4, -1, -2, -3, -4], dtype=np.int16).reshape(8, 1, 1)
+
+    def name(self):
+        return 'simple'
+# end::simple_init[]
+
+# tag::simple_encode[]
+    def encode(self, game_state, out=None):
+        if out is None:
+            out = np.zeros(self.shape())
+        board = game_state.board
+        if not has_board_arrays([game_state]):
+            return self.encode_by_points(game_state, out)  # <1>
+        codes = np.minimum(board.liberty_counts(), 4)  # <2>
+        codes *= board.stone_colors()
+        np.equal(codes, self.plane_codes, out=out[:8])  # <3>
+        black_to_play = game_state.next_player == Player.black
+        out[8] = black_to_play
+        out[9] = not black_to_play
+        out[10] = 0
+        in_atari = codes == (-1 if black_to_play else 1)
+        ko = ko_points(board, game_state.next_player, game_state.previous_states, in_atari)  # <4>
+        for row, col in ko:
+            out[10, row, col] = 1
+        return out
+
+# <1> Boards without arrays of stone colours and liberty counts are encoded point by point.
+# <2> Liberty counts are kept by the board for every stone, so they are read directly instead of being computed for each position.
+# <3> Codes are liberty counts, negative for white stones, so a single comparison against the code of each plane fills all eight stone planes.
+# <4> Only the liberties of opponent strings in atari can be ko points, so only those are checked.
+# end::simple_encode[]
+
+    def encode_by_points(self, game_state, out):
+        out[...] = 0
+        if game_state.next_player == Player.black:
+            out[8] = 1
+        else:
+            out[9] = 1
+        for r in range(self.board_height):
+            for c in range(self.board_width):
+                p = Point(row=r + 1, col=c + 1)
+                go_string = game_state.board.get_go_string(p)
+                if go_string is None:
+                    if game_state.does_move_violate_ko(game_state.next_player, Move.play(p)):
+                        out[10, r, c] = 1
+                else:
+                    liberty_plane = min(4, go_string.num_liberties) - 1
+                    if go_string.color == Player.white:
+                        liberty_plane += 4
+                    out[liberty_plane, r, c] = 1
+        return out
+
+    def encode_into(self, game_state, out):
+        return self.encode(game_state, out=out)
+
+    # 複数の盤面の配列をまとめてから、一度の比較ですべての石の平面を埋める
+    def encode_batch(self, game_states, out=None):
+        if out is None:
+            out = np.zeros((len(game_states),) + self.shape(), dtype=self.dtype())
+        if not game_states or not has_board_arrays(game_states):
+            return Encoder.encode_batch(self, game_states, out)
+        colors, liberties, black_to_play = stack_boards(game_states)
+        codes = np.minimum(liberties, 4)
+        codes *= colors
+        np.equal(codes[:, np.newaxis], self.plane_codes, out=out[:, :8])
+        out[:, 8] = black_to_play[:, np.newaxis, np.newaxis]
+        out[:, 9] = ~black_to_play[:, np.newaxis, np.newaxis]
+        out[:, 10] = 0
+        for i, game_state in enumerate(game_states):
+            in_atari = codes[i] == (-1 if black_to_play[i] else 1)
+            ko = ko_points(game_state.board, game_state.next_player, game_state.previous_states,
+                           in_atari)
+            for row, col in ko:
+                out[i, 10, row, col] = 1
+        return out
+
+    def is_incremental(self):
+        return True
+
+    def stone_planes(self, colors, liberties):
+        codes = np.minimum(liberties, 4)
+        codes *= colors
+        return np.equal(codes, self.plane_codes.reshape(8, 1))
+
+    def encode_planes(self, planes, encoding, out):
+        black_to_play = encoding.next_player == Player.black
+        out[:8] = planes
+        out[8] = black_to_play
+        out[9] = not black_to_play
+        out[10] = 0
+        in_atari = planes[4] if black_to_play else planes[0]
+        ko = ko_points(encoding.board, encoding.next_player, encoding.previous_states, in_atari)
+        for row, col in ko:
+            out[10, row, col] = 1
+        return out
+
+    def encode_point(self, point):
+        return self.board_width * (point.row - 1) + (point.col - 1)
+
+    def decode_point_index(self, index):
+        row = index // self.board_width
+        col = index % self.board_width
+        return Point(row=row + 1, col=col + 1)
+
+    def num_points(self):
+        return self.board_width * self.board_height
+
+    def shape(self):
+        return self.num_planes, self.board_height, self.board_width
+
+
+def create(board_size):
+    return SimpleEncoder(board_size)
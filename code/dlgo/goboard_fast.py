@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import copy
+from array import array
+
+import numpy as np
+
 from dlgo.gotypes import Player, Point
 from dlgo.scoring import compute_game_result
 from dlgo import zobrist
@@ -98,6 +102,17 @@ class Board():
         self.num_rows = num_rows
         self.num_cols = num_cols
         self._grid = {}
+        # Stone colours, one byte per point: 1 for black, 255 (-1 as int8) for
+        # white, 0 for empty. Only kept once stone_colors() has been called.
+        self._colors = None
+        self._colors_view = None
+        # Liberties of the string each stone belongs to, 0 for empty points.
+        # Only kept once liberty_counts() has been called.
+        self._liberties = None
+        self._liberties_view = None
+        # Points whose colour or liberty count changed, see pop_changes().
+        # Only recorded once pop_changes() has been called.
+        self._changes = None
         self._hash = zobrist.EMPTY_BOARD
 
         global neighbor_tables
@@ -145,6 +160,13 @@ class Board():
             new_string = new_string.merged_with(same_color_string)
         for new_string_point in new_string.stones:
             self._grid[new_string_point] = new_string
+        if self._liberties is not None:
+            self._set_liberties(new_string)
+        if self._changes is not None:
+            self._changes.extend(new_string.stones)
+        if self._colors is not None:
+            self._colors[(point.row - 1) * self.num_cols + point.col - 1] = \
+                1 if player == Player.black else 255
         # Remove empty-point hash code.
         self._hash ^= zobrist.HASH_CODE[point, None]
         # Add filled point hash code.
@@ -165,6 +187,17 @@ class Board():
     def _replace_string(self, new_string):
         for point in new_string.stones:
             self._grid[point] = new_string
+        if self._liberties is not None:
+            self._set_liberties(new_string)
+        if self._changes is not None:
+            self._changes.extend(new_string.stones)
+
+    def _set_liberties(self, string):
+        liberties = self._liberties
+        num_cols = self.num_cols
+        num_liberties = string.num_liberties
+        for point in string.stones:
+            liberties[(point.row - 1) * num_cols + point.col - 1] = num_liberties
 
     def _remove_string(self, string):
         for point in string.stones:
@@ -177,6 +210,12 @@ class Board():
                 if neighbor_string is not string:
                     self._replace_string(neighbor_string.with_liberty(point))
             self._grid[point] = None
+            if self._colors is not None:
+                self._colors[(point.row - 1) * self.num_cols + point.col - 1] = 0
+            if self._liberties is not None:
+                self._liberties[(point.row - 1) * self.num_cols + point.col - 1] = 0
+            if self._changes is not None:
+                self._changes.append(point)
             # Remove filled point hash code.
             self._hash ^= zobrist.HASH_CODE[point, string.color]
             # Add empty point hash code.
@@ -239,6 +278,66 @@ class Board():
             return None
         return string
 
+    def stone_colors(self):
+        """Return a read-only int8 array of the stone colours, indexed [row - 1, col - 1].
+
+        Black stones are 1, white stones -1 and empty points 0. The array is
+        a view that follows later moves on this board; copy it to keep a
+        position.
+
+        Boards only keep the colours once they have been asked for, so
+        games that are never encoded don't pay for them. The first call
+        reads them from the board, and copies of the board keep them too.
+        """
+        if self._colors is None:
+            self._colors = bytearray(self.num_rows * self.num_cols)
+            for point, string in self._grid.items():
+                if string is not None:
+                    self._colors[(point.row - 1) * self.num_cols + point.col - 1] = \
+                        1 if string.color == Player.black else 255
+        if self._colors_view is None:
+            colors = np.frombuffer(self._colors, dtype=np.int8)
+            colors = colors.reshape((self.num_rows, self.num_cols))
+            colors.flags.writeable = False
+            self._colors_view = colors
+        return self._colors_view
+
+    def liberty_counts(self):
+        """Return a read-only int16 array of liberty counts, indexed [row - 1, col - 1].
+
+        Each stone holds the number of liberties of its string, empty points
+        hold 0. Like stone_colors(), this is a view that follows the board,
+        and the counts are only kept once they have been asked for.
+        """
+        if self._liberties is None:
+            self._liberties = array('h', bytes(2 * self.num_rows * self.num_cols))
+            for point, string in self._grid.items():
+                if string is not None:
+                    self._liberties[(point.row - 1) * self.num_cols + point.col - 1] = \
+                        string.num_liberties
+        if self._liberties_view is None:
+            liberties = np.frombuffer(self._liberties, dtype=np.int16)
+            liberties = liberties.reshape((self.num_rows, self.num_cols))
+            liberties.flags.writeable = False
+            self._liberties_view = liberties
+        return self._liberties_view
+
+    def pop_changes(self):
+        """Return the points changed since the last call, and forget them.
+
+        The points are given as indices (row - 1) * num_cols + (col - 1)
+        into the flattened stone_colors() and liberty_counts() arrays and
+        may repeat. Changes are only recorded from the first call on, which
+        therefore returns no points. A copy of the board starts with no
+        changes, and records them if the original did.
+        """
+        if self._changes is None:
+            self._changes = []
+        num_cols = self.num_cols
+        changes = [(point.row - 1) * num_cols + point.col - 1 for point in self._changes]
+        self._changes = []
+        return changes
+
     def __eq__(self, other):
         return isinstance(other, Board) and \
             self.num_rows == other.num_rows and \
@@ -246,10 +345,22 @@ class Board():
             self._hash() == other._hash()
 
     def __deepcopy__(self, memodict={}):
-        copied = Board(self.num_rows, self.num_cols)
+        # Copy the attributes directly; __init__ would set up tables and
+        # arrays only for them to be replaced.
+        copied = Board.__new__(Board)
+        copied.num_rows = self.num_rows
+        copied.num_cols = self.num_cols
+        copied.neighbor_table = self.neighbor_table
+        copied.corner_table = self.corner_table
+        copied.move_ages = MoveAge(copied)
         # Can do a shallow copy b/c the dictionary maps tuples
         # (immutable) to GoStrings (also immutable)
         copied._grid = copy.copy(self._grid)
+        copied._colors = None if self._colors is None else bytearray(self._colors)
+        copied._colors_view = None
+        copied._liberties = None if self._liberties is None else array('h', self._liberties)
+        copied._liberties_view = None
+        copied._changes = None if self._changes is None else []
         copied._hash = self._hash
         return copied
 
@@ -1 +1,3 @@
 from .sgf import *
+from .sgf_mainline import *
+from .sgf_writer import *
@@ -7,6 +7,8 @@ Adapted from gomill by Matthew Woodcraft, https://github.com/mattheww/gomill
 
 from __future__ import absolute_import
 import datetime
+import mmap
+import os
 
 import six
 
@@ -17,6 +19,8 @@ __all__ = [
     'Node',
     'Sgf_game',
     'Tree_node',
+    'iter_sgf_file',
+    'split_sgf_file',
 ]
 
 
@@ -32,12 +36,18 @@ class Node:
 
     Changing the SZ property isn't allowed.
 
+    Interpreted property values are memoised per node; the memo is dropped
+    whenever the node's properties are changed through its methods.
+
     """
+    __slots__ = ('_property_map', '_presenter', '_values')
 
     def __init__(self, property_map, presenter):
         # Map identifier (PropIdent) -> nonempty list of raw values
         self._property_map = property_map
         self._presenter = presenter
+        # Map identifier -> interpreted value, filled in by get()
+        self._values = None
 
     def get_size(self):
         """Return the board size used to interpret property values."""
@@ -117,6 +127,7 @@ class Node:
                 values != [str(self._presenter.size).encode(self._presenter.encoding)]:
             raise ValueError("changing size is not permitted")
         self._property_map[identifier] = values
+        self._values = None
 
     def unset(self, identifier):
         """Remove the specified property.
@@ -127,6 +138,7 @@ class Node:
         if identifier == b"SZ" and self._presenter.size != 19:
             raise ValueError("changing size is not permitted")
         del self._property_map[identifier]
+        self._values = None
 
     def set_raw_list(self, identifier, values):
         """Set the raw values of the specified property.
@@ -183,8 +195,18 @@ class Node:
         See sgf_properties.Presenter.interpret() for details.
 
         """
-        return self._presenter.interpret(
-            identifier, self._property_map[identifier])
+        values = self._values
+        if values is None:
+            values = self._values = {}
+        try:
+            value = values[identifier]
+        except KeyError:
+            value = values[identifier] = self._presenter.interpret(
+                identifier, self._property_map[identifier])
+        # Hand out copies of mutable values, so callers can't alter the memo
+        if isinstance(value, (set, list)):
+            return type(value)(value)
+        return value
 
     def set(self, identifier, value):
         """Set the value of the specified property.
@@ -281,8 +303,10 @@ class Node:
             raise ValueError
         if b'B' in self._property_map:
             del self._property_map[b'B']
+            self._values = None
         if b'W' in self._property_map:
             del self._property_map[b'W']
+            self._values = None
         self.set(colour.upper().encode('ascii'), move)
 
     def set_setup_stones(self, black, white, empty=None):
@@ -295,10 +319,13 @@ class Node:
         """
         if b'AB' in self._property_map:
             del self._property_map[b'AB']
+            self._values = None
         if b'AW' in self._property_map:
             del self._property_map[b'AW']
+            self._values = None
         if b'AE' in self._property_map:
             del self._property_map[b'AE']
+            self._values = None
         if black:
             self.set(b'AB', black)
         if white:
@@ -351,6 +378,8 @@ class Tree_node(Node):
 
     """
 
+    __slots__ = ('owner', 'parent', '_children')
+
     def __init__(self, parent, properties):
         self.owner = parent.owner
         self.parent = parent
@@ -455,6 +484,10 @@ class Tree_node(Node):
 
 class _Root_tree_node(Tree_node):
     """Variant of Tree_node used for a game root."""
+    # _coarse_tree is only used by _Unexpanded_root_tree_node, but the slot
+    # lives here so that both classes share a layout and _expand() can switch
+    # the __class__ of a root node.
+    __slots__ = ('_coarse_tree',)
 
     def __init__(self, property_map, owner):
         self.owner = owner
@@ -465,6 +498,7 @@ class _Root_tree_node(Tree_node):
 
 class _Unexpanded_root_tree_node(_Root_tree_node):
     """Variant of _Root_tree_node used with 'loaded' Sgf_games."""
+    __slots__ = ()
 
     def __init__(self, owner, coarse_tree):
         _Root_tree_node.__init__(self, coarse_tree.sequence[0], owner)
@@ -822,3 +856,69 @@ class Sgf_game:
         if date is None:
             date = datetime.date.today()
         self.root.set('DT', date.strftime("%Y-%m-%d"))
+
+
+def _map_file(f):
+    if os.fstat(f.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def iter_sgf_file(path, start=0, end=None, override_encoding=None):
+    """Read the games of an SGF collection file one at a time.
+
+    path  -- name of a file holding one or more SGF games
+    start -- byte offset to start reading from
+    end   -- byte offset (optional): only games starting before it are read
+
+    Yields tuples (start, end, Sgf_game) with the byte offsets of each game in
+    the file.
+
+    The file is memory-mapped and only the game being parsed is held in
+    memory, so collections of any size can be read. start should be 0 or an
+    offset found by split_sgf_file(); see sgf_grammar.iter_sgf_collection()
+    for details.
+
+    Raises ValueError if there is an error parsing a game.
+
+    """
+    with open(path, 'rb') as f:
+        data = _map_file(f)
+        if data is None:
+            return
+        games = sgf_grammar.iter_sgf_collection(data, start, end)
+        try:
+            for game_start, game_end, coarse_game in games:
+                yield (game_start, game_end,
+                       Sgf_game.from_coarse_game_tree(coarse_game, override_encoding))
+        finally:
+            games.close()
+            data.close()
+
+
+def split_sgf_file(path, num_parts):
+    """Split an SGF collection file into parts of roughly equal size.
+
+    Returns a list of up to num_parts (start, end) byte ranges, each starting
+    at a game boundary, to be passed to iter_sgf_file() by separate workers.
+
+    """
+    with open(path, 'rb') as f:
+        data = _map_file(f)
+        if data is None:
+            return []
+        try:
+            size = len(data)
+            ranges = []
+            start = 0
+            for game_start, game_end in sgf_grammar.iter_game_offsets(data):
+                if len(ranges) == num_parts - 1:
+                    break
+                if game_end >= size * (len(ranges) + 1) // num_parts:
+                    ranges.append((start, game_end))
+                    start = game_end
+            if start < size or not ranges:
+                ranges.append((start, size))
+            return ranges
+        finally:
+            data.close()
@@ -41,6 +41,7 @@ _tokenise_re = re.compile(r"""
     (?P<D> [;()] )                                # delimiter
 )
 """.encode('ascii'), re.VERBOSE | re.DOTALL)
+_identifiers = {}
 
 
 def is_valid_property_identifier(s):
@@ -94,6 +95,8 @@ def tokenise(s, start_position=0):
     The first two tokens are always '(' and ';' (otherwise it won't find the
     start of the content).
 
+    Identifier tokens are interned: equal identifiers are the same object.
+
     """
     result = []
     m = _find_start_re.search(s, start_position)
@@ -101,14 +104,19 @@ def tokenise(s, start_position=0):
         return [], 0
     i = m.start()
     depth = 0
-    while True:
-        m = _tokenise_re.match(s, i)
-        if not m:
+    append = result.append
+    identifiers = _identifiers
+    for m in _tokenise_re.finditer(s, i):
+        if m.start() != i:
+            # finditer skipped something it couldn't tokenise
             break
         group = m.lastgroup
         token = m.group(m.lastindex)
-        result.append((group, token))
         i = m.end()
+        if group == 'I':
+            # Share one bytes object per identifier between all nodes
+            token = identifiers.setdefault(token, token)
+        append((group, token))
         if group == 'D':
             if token == b'(':
                 depth += 1
@@ -262,6 +270,62 @@ def parse_sgf_collection(s):
     return result
 
 
+def _find_game_start(s, position, end_position):
+    m = _find_start_re.search(s, position)
+    if not m or (end_position is not None and m.start() >= end_position):
+        return None
+    return m.start()
+
+
+def iter_sgf_collection(s, start_position=0, end_position=None):
+    """Read the games of an SGF game collection one at a time.
+
+    s              -- 8-bit string, or an object supporting the buffer
+                      protocol such as an mmap
+    start_position -- index into 's' to start reading from
+    end_position   -- index into 's' (optional)
+
+    Yields tuples (start, end, Coarse_game_tree), where s[start:end] is the
+    game's data. Only games starting before end_position are read; the last
+    one may end after it.
+
+    start_position should be 0 or the start or end of a game found earlier,
+    see iter_game_offsets(). Starting somewhere else may pick up '(;' in a
+    property value as the start of a game.
+
+    Raises ValueError if there is an error parsing a game; see
+    parse_sgf_game() for details.
+
+    """
+    position = start_position
+    while True:
+        start = _find_game_start(s, position, end_position)
+        if start is None:
+            return
+        try:
+            game_tree, position = _parse_sgf_game(s, start)
+        except ValueError as e:
+            raise ValueError("error parsing game at offset %d: %s" % (start, e))
+        yield start, position, game_tree
+
+
+def iter_game_offsets(s, start_position=0, end_position=None):
+    """Find the games of an SGF game collection without parsing them.
+
+    Yields pairs (start, end) as iter_sgf_collection() does. The games are
+    only tokenised, which makes this a cheap way to split a collection into
+    parts for separate workers.
+
+    """
+    position = start_position
+    while True:
+        start = _find_game_start(s, position, end_position)
+        if start is None:
+            return
+        tokens, position = tokenise(s, start)
+        yield start, position
+
+
 def block_format(pieces, width=79):
     """Concatenate bytestrings, adding newlines.
 
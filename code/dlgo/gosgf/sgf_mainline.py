@@ -0,0 +1,241 @@
+"""Read the main line of an SGF game without building the game tree.
+
+Sgf_game parses a game into a tree of nodes whose properties are
+interpreted on request. That is more than is needed to replay the moves of
+a game record: read_main_line() scans the SGF data once, keeps the raw
+properties of the root node and the B / W values of the main line, and
+returns them as a Main_line with the moves in a compact array.
+
+The main line is the sequence main_sequence_iter() provides: the root and
+the first variation at every branch. In the SGF data these are exactly the
+nodes before the first closing parenthesis, so scanning stops there.
+
+Like the rest of this package, this works with 8-bit strings.
+"""
+
+from __future__ import absolute_import
+import re
+from array import array
+
+import six
+
+from . import sgf_grammar
+from . import sgf_properties
+
+__all__ = [
+    'Main_line',
+    'read_main_line',
+]
+
+
+_find_start_re = re.compile(r"\(\s*;".encode('ascii'))
+_token_re = re.compile(r"""
+\s*
+(?:
+    (?P<M> (?: ; \s* [BW] \s* \[ [a-z]{0,2} \]                   # run of plain move nodes;
+               (?: \s* \[ [^\\\]]* (?: \\. [^\\\]]* )* \] )*     # values after the first
+               \s* )+ )                                          # are skipped
+    |
+    (?P<I> [A-Z]{1,8} ) \s*                                     # PropIdent
+    (?P<V> (?: \[ [^\\\]]* (?: \\. [^\\\]]* )* \] \s* )+ )      # PropValues
+    |
+    (?P<D> [;()] )                                              # delimiter
+)
+""".encode('ascii'), re.VERBOSE | re.DOTALL)
+_value_re = re.compile(r"\[ ( [^\\\]]* (?: \\. [^\\\]]* )* ) \]".encode('ascii'),
+                       re.VERBOSE | re.DOTALL)
+_move_re = re.compile(r"""
+; \s* ([BW]) \s* \[ ([a-z]{0,2}) \]
+(?: \s* \[ [^\\\]]* (?: \\. [^\\\]]* )* \] )*
+""".encode('ascii'), re.VERBOSE | re.DOTALL)
+_MOVES, _IDENTIFIER, _VALUES, _DELIMITER = 1, 2, 3, 4  # group indices in _token_re
+_COLOURS = {b"B": 'b', b"W": 'w'}
+
+_point_codes_by_size = {}
+
+
+def _point_codes(size):
+    """Return a dict mapping raw move values to row * size + col, or -1 for a pass."""
+    try:
+        return _point_codes_by_size[size]
+    except KeyError:
+        pass
+    codes = {b"": -1}
+    if size <= 19:
+        codes[b"tt"] = -1
+    for row in range(size):
+        for col in range(size):
+            raw = sgf_properties.serialise_go_point((row, col), size)
+            codes[raw] = row * size + col
+    _point_codes_by_size[size] = codes
+    return codes
+
+
+class Main_line:
+    """The main line of an SGF game, as returned by read_main_line().
+
+    Public attributes (treat as read-only):
+      size    -- board size (int)
+      root    -- raw property map of the root node
+      colours -- string with one 'b' or 'w' per move
+      moves   -- array of signed 16-bit ints, row * size + col, or -1 for a
+                 pass, in the GTP coordinate system used by get_move()
+
+    Nodes without a B or W property are left out of colours and moves.
+
+    The get_* methods interpret root properties the same way the
+    corresponding Sgf_game methods do, and raise ValueError for malformed
+    values. Setup stones are only read from the root node.
+    """
+    __slots__ = ('size', 'root', 'colours', 'moves')
+
+    def __init__(self, size, root, colours, moves):
+        self.size = size
+        self.root = root
+        self.colours = colours
+        self.moves = moves
+
+    def __len__(self):
+        return len(self.moves)
+
+    def get_size(self):
+        """Return the board size as an integer."""
+        return self.size
+
+    def get_moves(self):
+        """Return the moves as a list of pairs (colour, move).
+
+        colour is 'b' or 'w'; move is (row, col), or None for a pass, as
+        returned by Tree_node.get_move().
+        """
+        size = self.size
+        return [(colour, divmod(move, size) if move >= 0 else None)
+                for colour, move in zip(self.colours, self.moves)]
+
+    def get_handicap(self):
+        """Return the number of handicap stones as a small integer.
+
+        Returns None if the HA property isn't present, or has (illegal) value
+        zero.
+        """
+        try:
+            handicap = sgf_properties.interpret_number(self.root[b"HA"][0])
+        except KeyError:
+            return None
+        if handicap == 0:
+            handicap = None
+        elif handicap == 1:
+            raise ValueError
+        return handicap
+
+    def get_komi(self):
+        """Return the komi as a float, 0.0 if the KM property isn't present."""
+        try:
+            return sgf_properties.interpret_real(self.root[b"KM"][0])
+        except KeyError:
+            return 0.0
+
+    def get_result(self):
+        """Return the RE property as a string, or None if it isn't present."""
+        try:
+            raw = self.root[b"RE"][0]
+        except KeyError:
+            return None
+        return sgf_grammar.simpletext_value(raw).decode('ISO-8859-1')
+
+    def get_setup_stones(self):
+        """Return the root's (black_points, white_points, empty_points) sets of (row, col)."""
+        context = sgf_properties._Context(self.size, None)
+        return tuple(sgf_properties.interpret_point_list(self.root.get(identifier, []), context)
+                     for identifier in (b"AB", b"AW", b"AE"))
+
+
+def read_main_line(s):
+    """Read the main line of the first game in a string of SGF data.
+
+    s -- 8-bit string
+
+    Returns a Main_line.
+
+    Raises ValueError if no game is found, if the data can't be tokenised
+    before the end of the main line, or if a move or the SZ property is
+    malformed. Data after the main line isn't looked at.
+
+    As with Tree_node.get_move(), a node with both B and W counts as a black
+    move and only the first value of a move property is used.
+    """
+    if not isinstance(s, six.binary_type):
+        s = s.encode('ascii')
+    m = _find_start_re.search(s)
+    if not m:
+        raise ValueError("no SGF data found")
+    position = m.start()
+    root = properties = None
+    colours = []
+    raw_moves = []
+    colour = raw = None
+    for m in _token_re.finditer(s, position):
+        if m.start() != position:
+            raise ValueError("unexpected data in main line")
+        position = m.end()
+        group = m.lastindex
+        if group == _VALUES:
+            if root is None:
+                raise ValueError("property value outside a node")
+            identifier, values = m.group(_IDENTIFIER, _VALUES)
+            if identifier == b"B":
+                if colour != 'b':
+                    colour, raw = 'b', values[1:values.index(b"]")]
+            elif identifier == b"W":
+                if colour is None:
+                    colour, raw = 'w', values[1:values.index(b"]")]
+            if properties is not None:
+                properties.setdefault(identifier, []).extend(_value_re.findall(values))
+            continue
+
+        # A new node starts, or the main line ends: store the pending move
+        if colour is not None:
+            colours.append(colour)
+            raw_moves.append(raw)
+            colour = raw = None
+        if group == _MOVES:
+            # Nodes holding nothing but a move make up the bulk of a game
+            # record and are read in one go. The move of the last one stays
+            # pending, as more properties of that node may follow.
+            moves = _move_re.findall(m.group(_MOVES))
+            properties = None
+            if root is None:
+                root = {moves[0][0]: [moves[0][1]]}
+                if len(moves) == 1:
+                    properties = root
+            for identifier, value in moves:
+                colours.append(_COLOURS[identifier])
+                raw_moves.append(value)
+            colour, raw = colours.pop(), raw_moves.pop()
+            continue
+        token = m.group(_DELIMITER)
+        if token == b';':
+            if root is None:
+                root = properties = {}
+            else:
+                properties = None
+        elif token == b')':
+            break
+    else:
+        raise ValueError("unexpected end of SGF data")
+
+    try:
+        size_s = root[b"SZ"][0]
+    except KeyError:
+        size = 19
+    else:
+        try:
+            size = int(size_s)
+        except ValueError:
+            raise ValueError("bad SZ property: %s" % size_s)
+    codes = _point_codes(size)
+    try:
+        moves = array('h', [codes[raw] for raw in raw_moves])
+    except KeyError as e:
+        raise ValueError("bad move: %s" % e.args[0])
+    return Main_line(size, root, ''.join(colours), moves)
@@ -0,0 +1,120 @@
+"""Write game records as SGF without building game trees.
+
+Sgf_game.serialise() turns a tree of nodes into SGF. Game records that are
+a single line of moves, as produced by self-play, don't need the tree:
+serialise_main_line() writes the root properties and moves straight into
+SGF, and Sgf_collection_writer appends such games to a collection file
+through a large write buffer.
+
+The output can be read back with Sgf_game.from_string(), iter_sgf_file() or
+read_main_line().
+"""
+
+from __future__ import absolute_import
+
+from . import sgf_grammar
+from . import sgf_properties
+
+__all__ = [
+    'Sgf_collection_writer',
+    'serialise_main_line',
+]
+
+
+_move_nodes_by_size = {}
+
+
+def _move_nodes(size):
+    """Return a dict mapping (colour, move) pairs to serialised move nodes."""
+    try:
+        return _move_nodes_by_size[size]
+    except KeyError:
+        pass
+    nodes = {}
+    for move in [None] + [(row, col) for row in range(size) for col in range(size)]:
+        value = sgf_properties.serialise_go_point(move, size)
+        nodes['b', move] = b";B[" + value + b"]"
+        nodes['w', move] = b";W[" + value + b"]"
+    _move_nodes_by_size[size] = nodes
+    return nodes
+
+
+def serialise_main_line(size, moves, komi=None, result=None, setup_stones=None,
+                        properties=None, encoding="UTF-8", wrap=79):
+    """Serialise a game without variations as SGF.
+
+    size         -- board size (int), in range 1 to 26
+    moves        -- iterable of pairs (colour, move), as from
+                    Tree_node.get_move(): colour is 'b' or 'w', move is
+                    (row, col) or None for a pass
+    komi         -- float (optional)
+    result       -- RE value as a string, eg "B+R" (optional)
+    setup_stones -- pair (black_points, white_points) of collections of
+                    (row, col) to add to the root node (optional)
+    properties   -- further root properties, a dict mapping identifiers to
+                    raw values (optional)
+    encoding     -- the CA value, used to encode 'result'
+    wrap         -- int, or None
+
+    Returns an 8-bit string.
+
+    Raises ValueError if a move is off the board.
+
+    """
+    if not 1 <= size <= 26:
+        raise ValueError("size out of range: %s" % size)
+    pieces = [b"(;FF[4]", b"GM[1]", b"SZ[%d]" % size, b"CA[" + encoding.encode('ascii') + b"]"]
+    if komi is not None:
+        pieces.append(b"KM[" + repr(float(komi)).encode('ascii') + b"]")
+    if result is not None:
+        pieces.append(b"RE[" + sgf_grammar.escape_text(result.encode(encoding)) + b"]")
+    if setup_stones is not None:
+        for identifier, points in zip((b"AB", b"AW"), setup_stones):
+            if points:
+                pieces.append(identifier + b"".join(
+                    b"[" + sgf_properties.serialise_go_point(point, size) + b"]"
+                    for point in sorted(points)))
+    if properties:
+        for identifier, value in sorted(properties.items()):
+            pieces.append(identifier + b"[" + value + b"]")
+    move_nodes = _move_nodes(size)
+    try:
+        pieces.extend(move_nodes[move] for move in moves)
+    except KeyError as e:
+        raise ValueError("bad move: %s" % (e.args[0],))
+    pieces.append(b")")
+    if wrap is None:
+        return b"".join(pieces) + b"\n"
+    return sgf_grammar.block_format(pieces, wrap) + b"\n"
+
+
+class Sgf_collection_writer:
+    """Append games to an SGF collection file.
+
+    Instantiate with a file name and use write_game(), which takes the same
+    arguments as serialise_main_line(). Games are appended to the file, so
+    a collection can be extended over several runs. Writes go through a
+    buffer of buffer_size bytes; call close(), or use the writer as a context
+    manager, to flush it.
+
+    Public attributes (treat as read-only):
+      num_games -- number of games written by this writer
+    """
+    def __init__(self, path, buffer_size=1 << 20):
+        self.path = path
+        self.num_games = 0
+        self._file = open(path, 'ab', buffer_size)
+
+    def write_game(self, size, moves, **kwargs):
+        self._file.write(serialise_main_line(size, moves, **kwargs))
+        self.num_games += 1
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -33,7 +33,7 @@ network_layers = large.layers(input_shape)
 for layer in network_layers:
     model.add(layer)
 model.add(Dense(nb_classes, activation='softmax'))
-model.compile(loss='categorical_crossentropy', optimizer='adadelta', metrics=['accuracy'])
+model.compile(loss='sparse_categorical_crossentropy', optimizer='adadelta', metrics=['accuracy'])
 
 model.fit(X, y, batch_size=128, epochs=20, verbose=1)
 # end::e2e_model[]
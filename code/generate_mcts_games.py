@@ -8,13 +8,15 @@ from dlgo.encoders import get_encoder_by_name
 from dlgo import goboard_fast as goboard
 from dlgo import mcts
 from dlgo.utils import print_board, print_move
+from dlgo.data.sgf_export import write_game_state
+from dlgo.gosgf import Sgf_collection_writer
 # end::generate_mcts_imports[]
 
 
 # tag::generate_mcts[]
-def generate_game(board_size, rounds, max_moves, temperature):
-    # boardsにはエンコードされた盤の状態が格納され、movesにはエンコードされた着手が格納される
-    boards, moves = [], []  # <1>
+def generate_game(board_size, rounds, max_moves, temperature, sgf_writer=None):
+    # statesにはエンコードする盤の状態が格納され、pointsには次の着手の点のインデックスが格納される
+    states, points = [], []  # <1>
 
     # OnePlaneEncoderを指定された盤のサイズで初期化する
     encoder = get_encoder_by_name('oneplane', board_size)  # <2>
@@ -32,14 +34,11 @@ def generate_game(board_size, rounds, max_moves, temperature):
         # 次の着手がボットによって選択される
         move = bot.select_move(game)  # <5>
         if move.is_play:
-            # エンコードされた盤の状態がboardsに追加される
-            boards.append(encoder.encode(game))  # <6>
+            # 盤の状態がstatesに追加される。エンコードは対局の後にまとめて行う
+            states.append(game)  # <6>
 
-            move_one_hot = np.zeros(encoder.num_points())
-            move_one_hot[encoder.encode_point(move.point)] = 1
-
-            # one-hotエンコードされた次の着手がmovesに追加される
-            moves.append(move_one_hot)  # <7>
+            # 次の着手の点のインデックスがpointsに追加される
+            points.append(encoder.encode_point(move.point))  # <7>
 
         print_move(game.next_player, move)
 
@@ -51,17 +50,27 @@ def generate_game(board_size, rounds, max_moves, temperature):
         if num_moves > max_moves:  # <9>
             break
 
-    return np.array(boards), np.array(moves)  # <10>
+    # 棋譜を保存する場合は、ゲームをSGFとして書き出す
+    if sgf_writer is not None:
+        write_game_state(sgf_writer, game)  # <10>
+
+    # すべての盤の状態を一つの配列にエンコードし、着手をone-hotエンコードする
+    boards = encoder.encode_batch(states)  # <11>
+    moves = np.zeros((len(points), encoder.num_points()))
+    moves[np.arange(len(points)), points] = 1
+    return boards, moves
 
-# <1> In `boards` we store encoded board state, `moves` is for encoded moves.
+# <1> In `states` we store the board states to encode, `points` is for the indices of the moves played.
 # <2> We initialize a OnePlaneEncoder by name with given board size.
 # <3> An new game of size `board_size` is instantiated.
 # <4> A Monte Carlo tree search agent with specified number of rounds and temperature will serve as our bot.
 # <5> The next move is selected by the bot.
-# <6> The encoded board situation is appended to `boards`.
-# <7> The one-hot-encoded next move is appended to `moves`.
+# <6> The board situation is appended to `states`, to be encoded once the game is over.
+# <7> The index of the next move is appended to `points`.
 # <8> Afterwards the bot move is applied to the board.
 # <9> We continue with the next move, unless the maximum number of moves has been reached.
+# <10> If requested, the game record is appended to an SGF collection, so it can be re-encoded later.
+# <11> All board states are encoded into one preallocated array in the encoder's compact dtype, and the moves are one-hot encoded.
 # end::generate_mcts[]
 
 
@@ -76,19 +85,25 @@ def main():
     parser.add_argument('--num-games', '-n', type=int, default=10)
     parser.add_argument('--board-out')
     parser.add_argument('--move-out')
+    parser.add_argument('--sgf-out',
+                        help='Append the games to this SGF collection file.')
 
     # このアプリケーションは、コマンドライン引数でカスタマイズすることができる
     args = parser.parse_args()  # <1>
     xs = []
     ys = []
+    sgf_writer = Sgf_collection_writer(args.sgf_out) if args.sgf_out else None
 
     for i in range(args.num_games):
         print('Generating game %d/%d...' % (i + 1, args.num_games))
 
         # 指定した数のゲームについて、ゲームデータを生成する
-        x, y = generate_game(args.board_size, args.rounds, args.max_moves, args.temperature)  # <2>
+        x, y = generate_game(args.board_size, args.rounds, args.max_moves, args.temperature,  # <2>
+                             sgf_writer)
         xs.append(x)
         ys.append(y)
+    if sgf_writer is not None:
+        sgf_writer.close()
 
     # すべてのゲームが生成されたら、それぞれの特徴量とラベルを連結する
     x = np.concatenate(xs)  # <3>
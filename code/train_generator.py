@@ -1,5 +1,6 @@
 # tag::train_generator_imports[]
 from dlgo.data.parallel_processor import GoDataProcessor
+from dlgo.data.generator import PrefetchingDataGenerator
 from dlgo.encoders.oneplane import OnePlaneEncoder
 
 from dlgo.networks import small
@@ -27,9 +28,14 @@ processor = GoDataProcessor(encoder=encoder.name())  # <2>
 generator = processor.load_go_data('train', num_games, use_generator=True)  # <3>
 test_generator = processor.load_go_data('test', num_games, use_generator=True)
 
+# 訓練中に次のバッチをバックグラウンドのスレッドで先読みする
+generator = PrefetchingDataGenerator(generator, workers=2, queue_depth=8)  # <4>
+test_generator = PrefetchingDataGenerator(test_generator, workers=2, queue_depth=8)
+
 # <1> First we create an encoder of board size.
 # <2> Then we initialize a Go Data processor with it.
 # <3> From the processor we create two data generators, for training and testing.
+# <4> Both are wrapped so that the next batches are prepared on background threads while the model trains.
 # end::train_generator_generator[]
 
 # tag::train_generator_model[]
@@ -67,6 +73,10 @@ model.fit_generator(generator=generator.generate(batch_size, num_classes),  # <1
 # 評価のためのジェネレータとステップ数を指定する
 model.evaluate_generator(generator=test_generator.generate(batch_size, num_classes),
                          steps=test_generator.get_num_samples() / batch_size)  # <6>
+
+# 訓練ループがデータを待った時間を表示する
+print('>>> Training data stalls: %s' % generator.stats())
+print('>>> Test data stalls: %s' % test_generator.stats())
 # <1> We specify a training data generator for our batch size...
 # <2> ... and how many training steps per epoch we execute.
 # <3> An additional generator is used for validation...